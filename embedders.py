@@ -1,14 +1,19 @@
 from mal.adapter.openai import Embedder
 
+from rag.cache.embedding import EmbeddingCache, CachedEmbedder
 
-nomic = Embedder("local/nomic", 768)
-snowflake = Embedder("local/snowflake", 1024)
+
+# shared by all embedders, entries are keyed by model name so they never collide
+embedding_cache = EmbeddingCache("./local/embeddings.db")
+
+nomic = CachedEmbedder(Embedder("local/nomic", 768), embedding_cache)
+snowflake = CachedEmbedder(Embedder("local/snowflake", 1024), embedding_cache)
 
 
 if __name__ == "__main__":
     import asyncio
 
-    async def test_embedder(s: str, embedder: Embedder):
+    async def test_embedder(s: str, embedder: CachedEmbedder):
         embedding = await embedder.create_embedding(s)
         print(f"Embeddings: {embedding[:5]}")
         print(f"Dimensions: {len(embedding)}")
@@ -16,3 +21,4 @@ if __name__ == "__main__":
     s = "The quick brown fox jumps over the lazy dog."
     asyncio.run(test_embedder(s, nomic))
     asyncio.run(test_embedder(s, snowflake))
+    print(f"Cache hits: {embedding_cache.hits}, misses: {embedding_cache.misses}")
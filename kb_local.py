@@ -15,7 +15,7 @@ from util.fs import list_files
 from rag.text.pdf_loader import PDFLoader
 
 from embedders import snowflake
-from rag.store.base import Section, RAGStore
+from rag.store.base import Section, RAGStore, format_hits
 
 ## easily change vector store backend as below
 # pgvector
@@ -33,6 +33,22 @@ kb_store = PgVectorStore(
 #     name="books",
 #     path="./local/chromadb"
 # )
+# numpy (in-process, memory-mapped)
+# from rag.store.numpy_store import NumpyStore
+# kb_store = NumpyStore(
+#     embedder=snowflake,
+#     name="books",
+#     path="./local/npstore"
+# )
+
+## optionally rescore the 50 nearest sections, so the agent needs fewer of them
+# with a local cross-encoder (zh/en); needs the `rerank` extra, downloads the model on first use
+# and costs a 50 x 512-token forward pass per query on CPU
+# from rag.rank.rerank import CrossEncoderReranker
+# kb_store.reranker = CrossEncoderReranker("BAAI/bge-reranker-base")
+# or with the model-free BM25 scorer
+# from rag.rank.rerank import LexicalReranker
+# kb_store.reranker = LexicalReranker()
 
 import logfire
 import instrument
@@ -57,14 +73,16 @@ async def retrieve(context: RunContext[Deps], query: str) -> str:
         context: the call context.
         query: the search query.
     """
-    return await context.deps.store.retrieve(query, 10)
+    hits = await context.deps.store.retrieve_hits(query, 3)
+    return format_hits(hits)
 
 async def run_agent(question: str):
     """Entry point to run the agent and perform RAG based question answering."""
     logfire.info("Asking '{question}'", question=question)
 
-    deps = Deps(store=kb_store)
-    answer = await rag_agent.run(question, deps=deps)
+    async with kb_store:
+        deps = Deps(store=kb_store)
+        answer = await rag_agent.run(question, deps=deps)
     print(answer.output)
 
 
@@ -73,14 +91,15 @@ async def run_agent(question: str):
 async def prepare_book_content(path: Path) -> list[Section]:
     with logfire.span("loading data from file"):
         loader = PDFLoader(str(path))
-        chunks = loader.chunks(batch_size=10)
+        # about 256 tokens per chunk, leaving room for the title within the 512 of the snowflake embedder
+        chunks = loader.token_chunks(target_tokens=256, overlap_tokens=32, max_tokens=480)
         sections = []
-        for idx, chunk in enumerate(chunks):
+        for idx, (chunk, tokens) in enumerate(chunks):
             uri = str(path / str(idx))
             title = f"{path.stem} #{idx}"
             content = chunk
             embedding_content = "\n\n".join((f"title: {title}", content))
-            sections.append(Section(uri, title, content, embedding_content))
+            sections.append(Section(uri, title, content, embedding_content, source=path.name, tokens=tokens))
     return sections
 
 async def build_search_db():
@@ -94,7 +113,9 @@ async def build_search_db():
             with logfire.span("working on {file}", file=str(path)):
                 sections = await prepare_book_content(path)
                 with logfire.span("saving data to knowledge store"):
-                    await kb_store.load(sections)
+                    # prune is scoped to this book's source, so re-chunking drops its now stale
+                    # `<idx>` URIs without touching the other books
+                    await kb_store.load(sections, prune=True)
 
 
 ## put all things together
@@ -10,7 +10,7 @@ from pydantic_ai import RunContext
 from pydantic_ai.agent import Agent
 
 from embedders import nomic
-from rag.store.base import Section, RAGStore
+from rag.store.base import Section, RAGStore, format_hits
 
 ## easily change vector store backend as below
 # pgvector
@@ -28,6 +28,17 @@ kb_store = PgVectorStore(
 #     name="logfire_docs",
 #     path="./local/chromadb"
 # )
+# numpy (in-process, memory-mapped)
+# from rag.store.numpy_store import NumpyStore
+# kb_store = NumpyStore(
+#     embedder=nomic,
+#     name="logfire_docs",
+#     path="./local/npstore"
+# )
+
+# paraphrased questions reuse earlier results instead of hitting the store again
+from rag.cache.semantic import SemanticCache
+kb_store.result_cache = SemanticCache(max_distance=0.05)
 
 import logfire
 import instrument
@@ -52,14 +63,16 @@ async def retrieve(context: RunContext[Deps], query: str) -> str:
         context: the call context.
         query: the search query.
     """
-    return await context.deps.store.retrieve(query, 10)
+    hits = await context.deps.store.retrieve_hits(query, 10)
+    return format_hits(hits)
 
 async def run_agent(question: str):
     """Entry point to run the agent and perform RAG based question answering."""
     logfire.info("Asking '{question}'", question=question)
 
-    deps = Deps(store=kb_store)
-    answer = await rag_agent.run(question, deps=deps)
+    async with kb_store:
+        deps = Deps(store=kb_store)
+        answer = await rag_agent.run(question, deps=deps)
     print(answer.output)
 
 
@@ -88,7 +101,7 @@ async def prepare_content() -> list[Section]:
         response = await client.get(doc_json_url)
         response.raise_for_status()
     doc_sections = sessions_ta.validate_json(response.content)
-    return [Section(ds.uri(), ds.title, ds.content, ds.embedding_content())
+    return [Section(ds.uri(), ds.title, ds.content, ds.embedding_content(), source=ds.path)
             for ds in doc_sections]
 
 async def build_search_db():
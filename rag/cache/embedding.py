@@ -0,0 +1,188 @@
+from __future__ import annotations as _annotations
+
+from pathlib import Path
+import asyncio
+import hashlib
+import sqlite3
+import time
+
+import numpy as np
+import logfire
+
+from rag.store.base import Embedder, BatchEmbedder
+
+
+CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    model text NOT NULL,
+    dimensions integer NOT NULL,
+    hash blob NOT NULL,
+    embedding blob NOT NULL,
+    last_used real NOT NULL,
+    PRIMARY KEY (model, dimensions, hash)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings (last_used);
+"""
+
+
+class EmbeddingCache:
+    """On-disk embedding cache in a SQLite file, keyed by (model, dimensions, content hash).
+
+    Least recently used entries are evicted once the stored vectors exceed `max_bytes`. Lookups
+    only note their recency in memory; it is written with the next `put_many`, `evict` or `close`,
+    or once `touch_batch` keys are pending, so a cache hit costs no write.
+    """
+
+    def __init__(self, path: str="./local/embeddings.db", max_bytes: int=1 << 30,
+                 touch_batch: int=1000) -> None:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.executescript(CACHE_SCHEMA)
+        self.max_bytes = max_bytes
+        self.size = self.conn.execute(
+            "SELECT coalesce(sum(length(embedding)), 0) FROM embeddings"
+        ).fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+        self.touch_batch = touch_batch
+        # (model, dimensions, hash) -> last use not yet written
+        self._touched: dict[tuple[str, int, bytes], float] = {}
+
+    @staticmethod
+    def key(text: str) -> bytes:
+        return hashlib.sha256(text.encode()).digest()
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def get_many(self, model: str, dimensions: int, texts: list[str]) -> list[list[float] | None]:
+        keys = [self.key(text) for text in texts]
+        found: dict[bytes, bytes] = {}
+        # stay well below SQLite's bound parameter limit
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i+500]
+            placeholders = ",".join("?" * len(chunk))
+            found.update(self.conn.execute(
+                f"SELECT hash, embedding FROM embeddings "
+                f"WHERE model = ? AND dimensions = ? AND hash IN ({placeholders})",
+                (model, dimensions, *chunk)
+            ).fetchall())
+        now = time.time()
+        for key in found:
+            self._touched[(model, dimensions, key)] = now
+        if len(self._touched) >= self.touch_batch:
+            self._write_touched()
+            self.conn.commit()
+
+        results = [
+            np.frombuffer(found[key], dtype=np.float32).tolist() if key in found else None
+            for key in keys
+        ]
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return results
+
+    def _write_touched(self) -> None:
+        """Write pending recency updates; the caller commits."""
+        if not self._touched: return
+        self.conn.executemany(
+            "UPDATE embeddings SET last_used = ? WHERE model = ? AND dimensions = ? AND hash = ?",
+            [(now, *key) for key, now in self._touched.items()]
+        )
+        self._touched.clear()
+
+    def put_many(self, model: str, dimensions: int,
+                 texts: list[str], embeddings: list[list[float]]) -> None:
+        now = time.time()
+        # one row per key, the last embedding wins as with `INSERT OR REPLACE`
+        rows = {
+            self.key(text): (model, dimensions, self.key(text),
+                             np.asarray(embedding, dtype=np.float32).tobytes(), now)
+            for text, embedding in zip(texts, embeddings)
+        }
+        keys = list(rows)
+        replaced = 0
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i+500]
+            placeholders = ",".join("?" * len(chunk))
+            replaced += self.conn.execute(
+                f"SELECT coalesce(sum(length(embedding)), 0) FROM embeddings "
+                f"WHERE model = ? AND dimensions = ? AND hash IN ({placeholders})",
+                (model, dimensions, *chunk)
+            ).fetchone()[0]
+        self._write_touched()
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (model, dimensions, hash, embedding, last_used) "
+            "VALUES (?, ?, ?, ?, ?)",
+            rows.values()
+        )
+        self.conn.commit()
+        self.size += sum(len(row[3]) for row in rows.values()) - replaced
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def evict(self) -> None:
+        """Drop least recently used entries until the cache is at 90% of `max_bytes`."""
+        target = int(self.max_bytes * 0.9)
+        with logfire.span("evict embedding cache down to {target} bytes", target=target):
+            self._write_touched()
+            cursor = self.conn.execute(
+                "SELECT model, dimensions, hash, length(embedding) FROM embeddings ORDER BY last_used"
+            )
+            victims = []
+            size = self.size
+            for model, dimensions, key, length in cursor:
+                if size <= target: break
+                victims.append((model, dimensions, key))
+                size -= length
+            self.conn.executemany(
+                "DELETE FROM embeddings WHERE model = ? AND dimensions = ? AND hash = ?", victims
+            )
+            self.conn.commit()
+            self.size = size
+
+    def close(self) -> None:
+        self._write_touched()
+        self.conn.commit()
+        self.conn.close()
+
+
+class CachedEmbedder:
+    """Drop-in wrapper around an `Embedder` that serves repeated texts from an `EmbeddingCache`.
+
+    It satisfies the `Embedder` and `BatchEmbedder` protocols the stores are typed against. Misses
+    go to the wrapped embedder `batch_size` at a time, through its own batch path when it has one.
+    """
+
+    def __init__(self, embedder: Embedder, cache: EmbeddingCache, batch_size: int=64) -> None:
+        self.embedder = embedder
+        self.cache = cache
+        self.batch_size = batch_size
+        self.client = embedder.client
+        self.model = embedder.model
+        self.dimensions = embedder.dimensions
+
+    async def create_embedding(self, text: str) -> list[float]:
+        return (await self.create_embeddings([text]))[0]
+
+    async def _embed(self, texts: list[str]) -> list[list[float]]:
+        if isinstance(self.embedder, BatchEmbedder):
+            return await self.embedder.create_embeddings(texts)
+        return list(await asyncio.gather(*(self.embedder.create_embedding(text) for text in texts)))
+
+    async def create_embeddings(self, texts: list[str]) -> list[list[float]]:
+        cached = self.cache.get_many(self.model, self.dimensions, texts)
+        missing_texts = list(dict.fromkeys(text for text, embedding in zip(texts, cached) if embedding is None))
+        created: dict[str, list[float]] = {}
+        size = max(1, self.batch_size)
+        for i in range(0, len(missing_texts), size):
+            batch = missing_texts[i:i+size]
+            embeddings = await self._embed(batch)
+            self.cache.put_many(self.model, self.dimensions, batch, embeddings)
+            created.update(zip(batch, embeddings))
+        if missing_texts:
+            logfire.debug("embedding cache {hits=} {misses=}", hits=self.cache.hits, misses=self.cache.misses)
+        return [embedding if embedding is not None else created[text] for text, embedding in zip(texts, cached)]
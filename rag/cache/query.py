@@ -0,0 +1,59 @@
+from __future__ import annotations as _annotations
+from collections import OrderedDict
+
+import re
+import time
+
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_query(query: str) -> str:
+    """Collapse whitespace and fold case so trivially different queries share an entry."""
+    return _WHITESPACE.sub(" ", query).strip().casefold()
+
+
+class QueryCache:
+    """In-memory LRU cache of query -> embedding with a time-to-live per entry."""
+
+    def __init__(self, maxsize: int=1024, ttl: float=3600.0, normalize: bool=True) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.normalize = normalize
+        self._entries: OrderedDict[str, tuple[float, list[float]]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, query: str) -> str:
+        return normalize_query(query) if self.normalize else query
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def get(self, query: str) -> list[float] | None:
+        key = self._key(query)
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires, embedding = entry
+            if expires > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return embedding
+            del self._entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, query: str, embedding: list[float]) -> None:
+        key = self._key(query)
+        self._entries[key] = (time.monotonic() + self.ttl, embedding)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,79 @@
+from __future__ import annotations as _annotations
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Hashable
+
+import numpy as np
+
+from rag.store.base import Hit
+from rag.vector import normalize
+
+
+@dataclass(slots=True)
+class _Entry:
+    key: Hashable
+    hits: list[Hit]
+    # how long producing `hits` took, credited to `saved_seconds` on every reuse
+    latency: float
+
+
+class SemanticCache:
+    """In-memory cache of retrieval results looked up by query meaning rather than query text.
+
+    A lookup hits when a cached query with the same `key` (limit and filter) has an embedding
+    within cosine distance `max_distance` of the new one, so paraphrases such as "configure logfire
+    with FastAPI" / "how to set up logfire in a FastAPI app" share results. Embeddings live in one
+    fixed `maxsize` x dimensions matrix, evicting the least recently used entry when full.
+    """
+
+    def __init__(self, max_distance: float=0.05, maxsize: int=256) -> None:
+        self.max_distance = max_distance
+        self.maxsize = maxsize
+        self._matrix: np.ndarray | None = None
+        # slot -> entry, least recently used first
+        self._entries: OrderedDict[int, _Entry] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    @staticmethod
+    def _unit(embedding) -> np.ndarray:
+        return normalize(np.asarray(embedding, dtype=np.float32))
+
+    def get(self, embedding, key: Hashable) -> list[Hit] | None:
+        slots = [slot for slot, entry in self._entries.items() if entry.key == key]
+        if slots and self._matrix is not None:
+            similarities = self._matrix[slots] @ self._unit(embedding)
+            best = int(np.argmax(similarities))
+            if 1.0 - similarities[best] <= self.max_distance:
+                slot = slots[best]
+                self._entries.move_to_end(slot)
+                entry = self._entries[slot]
+                self.hits += 1
+                self.saved_seconds += entry.latency
+                return list(entry.hits)
+        self.misses += 1
+        return None
+
+    def put(self, embedding, key: Hashable, hits: list[Hit], latency: float) -> None:
+        vector = self._unit(embedding)
+        if self._matrix is None:
+            self._matrix = np.zeros((self.maxsize, vector.shape[0]), dtype=np.float32)
+        if len(self._entries) < self.maxsize:
+            slot = len(self._entries)
+        else:
+            slot, _ = self._entries.popitem(last=False)
+        self._matrix[slot] = vector
+        self._entries[slot] = _Entry(key, list(hits), latency)
+
+    def clear(self) -> None:
+        """Forget every entry, e.g. after the store behind it was reloaded."""
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,46 @@
+from __future__ import annotations as _annotations
+
+import numpy as np
+
+from rag.vector import normalize
+
+
+def mmr(query_embedding, candidate_embeddings, k: int, lambda_: float=0.5) -> list[int]:
+    """Maximal marginal relevance: pick `k` candidates balancing relevance against redundancy.
+
+    `lambda_` of 1 is pure relevance ranking, 0 pure diversity. Similarities are cosine; when the
+    candidates are shorter than the query (a truncated index) the query is cut to match.
+    Returns indices into `candidate_embeddings` in selection order.
+    """
+    candidates = normalize(np.asarray(candidate_embeddings, dtype=np.float32))
+    n = candidates.shape[0]
+    k = min(k, n)
+    if k <= 0: return []
+    query = normalize(np.asarray(query_embedding, dtype=np.float32)[:candidates.shape[1]])
+
+    relevance = candidates @ query
+    similarity = candidates @ candidates.T
+    # highest similarity of each candidate to anything already selected
+    redundancy = np.zeros(n, dtype=np.float32)
+    available = np.ones(n, dtype=bool)
+    selected: list[int] = []
+    for _ in range(k):
+        scores = lambda_ * relevance - (1 - lambda_) * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        redundancy = similarity[best] if len(selected) == 1 else np.maximum(redundancy, similarity[best])
+    return selected
+
+
+if __name__ == "__main__":
+    import timeit
+
+    rng = np.random.default_rng(0)
+    for n, d in ((40, 768), (100, 1024), (400, 1024)):
+        query = rng.standard_normal(d)
+        candidates = rng.standard_normal((n, d))
+        runs = 200
+        seconds = timeit.timeit(lambda: mmr(query, candidates, 10), number=runs) / runs
+        print(f"mmr top-10 of {n} x {d}: {seconds * 1000:.3f} ms")
@@ -0,0 +1,178 @@
+from __future__ import annotations as _annotations
+from abc import ABC, abstractmethod
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import asyncio
+import math
+import re
+
+import logfire
+
+from rag.store.base import Hit
+
+
+# words, or single CJK characters since Chinese text has no spaces to split on
+_TOKEN = re.compile(r"[㐀-鿿]|\w+")
+
+
+def tokenize(text: str) -> list[str]:
+    return _TOKEN.findall(text.casefold())
+
+
+class Reranker(ABC):
+    """Rescores ANN candidates with a CPU model, off the event loop and with a score cache.
+
+    Subclasses implement `score`; candidates are scored in batches of `batch_size` on a private
+    pool of `max_workers` threads (numpy and torch release the GIL for the heavy parts). Scores
+    are cached per `(query, uri)` in an LRU of `cache_size` entries; call `clear` after reloading
+    a store whose content changed under the same URIs. Subclasses whose scores depend on the whole
+    candidate set set `whole_set`: they get every candidate in one call and are not cached.
+    """
+
+    whole_set = False
+
+    def __init__(self, batch_size: int=32, cache_size: int=4096, max_workers: int=1) -> None:
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self.max_workers = max_workers
+        self.executor: ThreadPoolExecutor | None = None
+        self._cache: OrderedDict[tuple[str, str], float] = OrderedDict()
+
+    @abstractmethod
+    def score(self, query: str, contents: list[str]) -> list[float]:
+        """Relevance of each content to `query`, higher is better; runs on a worker thread."""
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+    def close(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    async def rerank(self, query: str, hits: list[Hit], limit: int) -> list[Hit]:
+        """The `limit` best of `hits` by score, best first."""
+        scores: dict[str, float] = {}
+        if self.whole_set:
+            missing = hits
+            size = max(1, len(hits))
+        else:
+            for hit in hits:
+                score = self._cache.get((query, hit.uri))
+                if score is not None:
+                    scores[hit.uri] = score
+            missing = [hit for hit in hits if hit.uri not in scores]
+            size = self.batch_size
+        if missing:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="rerank")
+            loop = asyncio.get_running_loop()
+            batches = [missing[i:i+size] for i in range(0, len(missing), size)]
+            with logfire.span("rerank {count} candidates", count=len(missing)):
+                results = await asyncio.gather(*(
+                    loop.run_in_executor(self.executor, self.score, query, [hit.content for hit in batch])
+                    for batch in batches
+                ))
+            for batch, batch_scores in zip(batches, results):
+                for hit, score in zip(batch, batch_scores):
+                    scores[hit.uri] = score
+        if not self.whole_set:
+            for hit in missing:
+                self._cache[(query, hit.uri)] = scores[hit.uri]
+            for hit in hits:
+                self._cache.move_to_end((query, hit.uri))
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+        return sorted(hits, key=lambda hit: scores[hit.uri], reverse=True)[:limit]
+
+
+class LexicalReranker(Reranker):
+    """BM25 over the candidate set itself, no model needed; a cheap precision boost for keyword queries.
+
+    IDF and the average length come from the candidates, so they are scored together and not cached.
+    """
+
+    whole_set = True
+
+    def __init__(self, k1: float=1.2, b: float=0.75, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.k1 = k1
+        self.b = b
+
+    def score(self, query: str, contents: list[str]) -> list[float]:
+        docs = [Counter(tokenize(content)) for content in contents]
+        if not docs: return []
+        avg_len = sum(sum(doc.values()) for doc in docs) / len(docs) or 1.0
+        terms = set(tokenize(query))
+        idf = {
+            term: math.log(1 + (len(docs) - df + 0.5) / (df + 0.5))
+            for term in terms
+            for df in [sum(term in doc for doc in docs)]
+        }
+        scores = []
+        for doc in docs:
+            length = sum(doc.values())
+            scores.append(sum(
+                idf[term] * doc[term] * (self.k1 + 1)
+                / (doc[term] + self.k1 * (1 - self.b + self.b * length / avg_len))
+                for term in terms if term in doc
+            ))
+        return scores
+
+
+class CrossEncoderReranker(Reranker):
+    """A local cross-encoder (query and passage read together), e.g. `BAAI/bge-reranker-base`.
+
+    Needs the `rerank` extra (`torch` and `transformers`); the model is downloaded and loaded on first use.
+    """
+
+    def __init__(self, model: str="cross-encoder/ms-marco-MiniLM-L-6-v2", max_length: int=512,
+                 **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.model_name = model
+        self.max_length = max_length
+        self._model = None
+        self._tokenizer = None
+
+    def score(self, query: str, contents: list[str]) -> list[float]:
+        import torch
+        from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+        if self._model is None or self._tokenizer is None:
+            with logfire.span("load reranker {model}", model=self.model_name):
+                self._tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+                self._model = AutoModelForSequenceClassification.from_pretrained(self.model_name).eval()
+        tokenizer, model = self._tokenizer, self._model
+
+        inputs = tokenizer(
+            [query] * len(contents), contents,
+            padding=True, truncation=True, max_length=self.max_length, return_tensors="pt"
+        )
+        with torch.inference_mode():
+            logits = model(**inputs).logits
+        # single-logit relevance heads; otherwise take the "relevant" class
+        return (logits[:, 0] if logits.shape[1] == 1 else logits[:, -1]).tolist()
+
+
+if __name__ == "__main__":
+    import time
+
+    passages = [
+        "Logfire integrates with FastAPI through logfire.instrument_fastapi(app).",
+        "The CAP theorem states a distributed store can only guarantee two of three properties.",
+        "Spans are the building blocks of traces.",
+        "分布式系统中，CAP 定理指出一致性、可用性和分区容错性不能同时满足。",
+    ] * 25
+    hits = [Hit(f"doc/{i}", f"#{i}", content, 0.0) for i, content in enumerate(passages)]
+
+    async def main() -> None:
+        reranker = LexicalReranker()
+        for label in ("cold", "warm"):
+            start = time.perf_counter()
+            top = await reranker.rerank("what is the CAP theorem", hits, 3)
+            print(f"{label}: {(time.perf_counter() - start) * 1000:.2f} ms, top: {[hit.uri for hit in top]}")
+        reranker.close()
+
+    asyncio.run(main())
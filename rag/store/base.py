@@ -1,8 +1,44 @@
 from __future__ import annotations as _annotations
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
 from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING, Any, AsyncIterator, Hashable, Mapping, Protocol, Sequence, runtime_checkable
 
-from mal.adapter.openai import Embedder
+from asyncio import Semaphore, TaskGroup, gather
+import hashlib
+import time
+
+import numpy as np
+import logfire
+
+from rag.cache.query import QueryCache
+from rag.rank.mmr import mmr
+from rag.vector import normalize
+
+if TYPE_CHECKING:
+    from rag.cache.semantic import SemanticCache
+    from rag.rank.rerank import Reranker
+    from rag.store.snapshot import Snapshot
+
+
+@runtime_checkable
+class Embedder(Protocol):
+    """What stores need from an embedder; `mal`'s `Embedder` and `CachedEmbedder` both fit."""
+    @property
+    def model(self) -> str: ...
+    @property
+    def dimensions(self) -> int: ...
+    # an `AsyncOpenAI` client
+    @property
+    def client(self) -> Any: ...
+
+    async def create_embedding(self, text: str) -> list[float]: ...
+
+
+@runtime_checkable
+class BatchEmbedder(Embedder, Protocol):
+    """An embedder with its own batch path, e.g. `CachedEmbedder`."""
+    async def create_embeddings(self, texts: list[str]) -> list[list[float]]: ...
 
 
 @dataclass
@@ -11,16 +47,387 @@ class Section:
     title: str
     content: str
     embedding_content: str
+    # metadata usable in `SectionFilter`
+    source: str = ""
+    lang: str = ""
+    tags: list[str] = field(default_factory=list)
+    ingested_at: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+    # size of `content` in tokens, when the chunker knows it (see `rag.text.chunk.pack_sentences`)
+    tokens: int = 0
+
+    @property
+    def content_hash(self) -> str:
+        """Digest of the text fields, the embedded one included; when it changes the section is re-embedded.
+
+        `source`, `lang` and `tags` are covered by `meta_hash` instead, so editing them only updates the row.
+        """
+        return _digest(self.title, self.content, self.embedding_content)
+
+    @property
+    def meta_hash(self) -> str:
+        """Digest of the filterable metadata except `ingested_at`."""
+        return _digest(self.source, self.lang, *self.tags)
+
+
+def _digest(*parts: str) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+@dataclass
+class StoredSection(Section):
+    """A section read back from a store, which keeps its hash but not its `embedding_content`."""
+    stored_hash: str = ""
+
+    @property
+    def content_hash(self) -> str:
+        return self.stored_hash
+
+
+@dataclass(slots=True)
+class SectionFilter:
+    """Restricts a search to sections matching every given field, `None` leaves a field open.
+
+    `tags` matches sections carrying any of the tags; `since` is inclusive, `until` exclusive.
+    """
+    sources: list[str] | None = None
+    langs: list[str] | None = None
+    tags: list[str] | None = None
+    since: datetime | None = None
+    until: datetime | None = None
+
+
+@dataclass(slots=True)
+class Hit:
+    """A single retrieval result; `distance` is store specific, lower is closer."""
+    uri: str
+    title: str
+    content: str
+    distance: float
+    id: int | str | None = None
+    # the stored vector, only filled in when a search asks for `with_embeddings`
+    embedding: list[float] | np.ndarray | None = None
+
+
+def format_hits(hits: list[Hit]) -> str:
+    """Render hits as the Markdown context handed to agents."""
+    return "\n\n".join(f"# {hit.title}\nURI:{hit.uri}\n\n{hit.content}\n" for hit in hits)
 
 
 class RAGStore(ABC):
-    def __init__(self, embedder: Embedder) -> None:
+    # whether `export_snapshot` / `import_snapshot` work, i.e. `_scan` and `_load_embedded` (or `_import`) are implemented
+    supports_snapshots = False
+
+    def __init__(self, embedder: Embedder, embed_batch_size: int=64, embed_concurrency: int=4,
+                 index_dimensions: int | None=None) -> None:
+        if index_dimensions is not None and not 0 < index_dimensions <= embedder.dimensions:
+            raise ValueError(
+                f"index_dimensions must be between 1 and {embedder.dimensions}, got {index_dimensions}"
+            )
         self.embedder = embedder
+        # Matryoshka-style truncation of what goes into the ANN index, see `truncate`
+        self.index_dimensions = index_dimensions or embedder.dimensions
+        self.embed_batch_size = embed_batch_size
+        self.embed_concurrency = embed_concurrency
+        # set to `None` to disable, or replace to tune size, TTL and normalization
+        self.query_cache: QueryCache | None = QueryCache()
+        # MMR diversification in `retrieve_hits`: `None` disables it, otherwise the relevance weight
+        # (1 is plain ranking); `limit * mmr_fetch_factor` candidates are fetched to choose from
+        self.mmr_lambda: float | None = None
+        self.mmr_fetch_factor = 4
+        # rescoring stage in `retrieve_hits`: `None` disables it, otherwise the `rerank_candidates`
+        # nearest sections are rescored and the best kept (before MMR when both are on)
+        self.reranker: Reranker | None = None
+        self.rerank_candidates = 50
+        # opt-in cache of `retrieve_hits` results for near-identical queries, cleared by `invalidate`
+        self.result_cache: SemanticCache | None = None
+
+    async def open(self) -> None:
+        """Acquire long-lived resources (connections, pools); a no-op unless overridden."""
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    async def __aenter__(self) -> RAGStore:
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    def cosine_distance(self, distance: float) -> float:
+        """`Hit.distance` of this store as a cosine distance, comparable across stores.
+
+        Stores whose native metric is not cosine distance override this.
+        """
+        return distance
+
+    def truncate(self, embeddings) -> np.ndarray:
+        """Cut embeddings (one or a batch) to `index_dimensions` and L2-renormalize them.
+
+        Embeddings already at `index_dimensions` (e.g. from a snapshot) are returned unchanged.
+        """
+        arr = np.asarray(embeddings, dtype=np.float32)
+        if self.index_dimensions == arr.shape[-1]:
+            return arr
+        if arr.shape[-1] != self.embedder.dimensions:
+            raise ValueError(f"expected {self.embedder.dimensions} dimensions, got {arr.shape[-1]}")
+        return normalize(arr[..., :self.index_dimensions])
+
+    async def create_embeddings(self, texts: list[str]) -> list[list[float]]:
+        """Embed `texts` in batches, keeping at most `embed_concurrency` requests in flight.
+
+        The result is aligned with `texts`.
+        """
+        size = max(1, self.embed_batch_size)
+        batches = [texts[i:i+size] for i in range(0, len(texts), size)]
+        sem = Semaphore(max(1, self.embed_concurrency))
+
+        async def embed(batch: list[str]) -> list[list[float]]:
+            async with sem:
+                with logfire.span("create embeddings for {count} texts", count=len(batch)):
+                    if isinstance(self.embedder, BatchEmbedder):
+                        return await self.embedder.create_embeddings(batch)
+                    response = await self.embedder.client.embeddings.create(
+                        model=self.embedder.model, input=batch
+                    )
+                    return [d.embedding for d in sorted(response.data, key=lambda d: d.index)]
+
+        with logfire.span("creating embeddings in {batches} batches", batches=len(batches)):
+            async with TaskGroup() as tg:
+                tasks = [tg.create_task(embed(batch)) for batch in batches]
+        return [embedding for task in tasks for embedding in task.result()]
+
+    async def embed_query(self, query: str) -> list[float]:
+        """Embed a retrieval query, served from `query_cache` when possible."""
+        if self.query_cache is not None:
+            embedding = self.query_cache.get(query)
+            if embedding is not None:
+                return embedding
+
+        with logfire.span("create embedding for {query=}", query=query):
+            embedding = await self.embedder.create_embedding(query)
+        if self.query_cache is not None:
+            self.query_cache.put(query, embedding)
+            logfire.debug("query cache {hit_rate=}", hit_rate=self.query_cache.hit_rate)
+        return embedding
+
+    async def embed_queries(self, queries: list[str]) -> list[list[float]]:
+        """Embed several retrieval queries with one batched request for the cache misses."""
+        cached = [self.query_cache.get(query) if self.query_cache is not None else None for query in queries]
+        missing = [query for query, embedding in zip(queries, cached) if embedding is None]
+        created = iter(await self.create_embeddings(missing) if missing else [])
+        embeddings: list[list[float]] = []
+        for query, embedding in zip(queries, cached):
+            if embedding is None:
+                embedding = next(created)
+                if self.query_cache is not None:
+                    self.query_cache.put(query, embedding)
+            embeddings.append(embedding)
+        return embeddings
+
+    def invalidate(self) -> None:
+        """Drop results cached for the previous contents; backends call it after writing."""
+        if self.result_cache is not None:
+            self.result_cache.clear()
+        if self.reranker is not None:
+            self.reranker.clear()
 
     @abstractmethod
-    async def load(self, sections: list[Section]) -> None:
+    async def load(self, sections: Sequence[Section], prune: bool=False) -> None:
+        """Upsert `sections`, re-embedding only new or changed ones.
+
+        With `prune`, stored sections of the same sources as `sections` whose URI is not among
+        them are deleted; other sources are left alone, so one source can be loaded at a time.
+        """
         pass
 
+    @staticmethod
+    def _classify(sections: Sequence[Section],
+                  stored: Mapping[str, tuple[str, str]]) -> tuple[list[Section], list[Section]]:
+        """Split off the sections to (re-)embed and those whose metadata alone changed.
+
+        `stored` maps the URIs already in the store to their `(content_hash, meta_hash)`.
+        """
+        changed: list[Section] = []
+        retagged: list[Section] = []
+        for section in sections:
+            content_hash, meta_hash = stored.get(section.uri, (None, None))
+            if content_hash != section.content_hash:
+                changed.append(section)
+            elif meta_hash != section.meta_hash:
+                retagged.append(section)
+        logfire.info("{unchanged} sections unchanged, {count} to load, {retagged} with new metadata",
+                     unchanged=len(sections) - len(changed) - len(retagged), count=len(changed),
+                     retagged=len(retagged))
+        return changed, retagged
+
     @abstractmethod
-    async def retrieve(self, query: str, limit: int) -> str:
+    async def search(self, query: str, limit: int, filter: SectionFilter | None=None,
+                     with_embeddings: bool=False) -> list[Hit]:
+        """Return the `limit` closest sections to `query` that pass `filter`, best first."""
         pass
+
+    async def search_many(self, queries: list[str], limit: int, filter: SectionFilter | None=None,
+                          with_embeddings: bool=False) -> list[list[Hit]]:
+        """Search for several queries at once, results aligned with `queries`.
+
+        Stores override this to embed all queries together and answer them in one round trip.
+        """
+        return list(await gather(*(
+            self.search(query, limit, filter, with_embeddings) for query in queries
+        )))
+
+    def _scan(self, batch_size: int) -> AsyncIterator[tuple[list[StoredSection], np.ndarray]]:
+        """Yield every stored section with its stored embedding, `batch_size` at a time.
+
+        Stores setting `supports_snapshots` implement this as an async generator.
+        """
+        raise NotImplementedError
+
+    async def _load_embedded(self, sections: Sequence[Section], embeddings: np.ndarray) -> None:
+        """Upsert `sections` with embeddings computed elsewhere, through the fastest write path."""
+        raise NotImplementedError
+
+    async def _import(self, snapshot: Snapshot) -> None:
+        for sections, embeddings in snapshot.chunks():
+            await self._load_embedded(sections, embeddings)
+
+    def _check_snapshots(self) -> None:
+        if not self.supports_snapshots:
+            raise NotImplementedError(f"{type(self).__name__} does not support snapshots")
+
+    async def export_snapshot(self, path: str, batch_size: int=10_000) -> int:
+        """Write all sections and their stored embeddings to a snapshot directory at `path`.
+
+        Returns the number of sections written. Snapshots are backend neutral, see `import_snapshot`.
+        """
+        from rag.store.snapshot import SnapshotWriter
+
+        self._check_snapshots()
+        writer: SnapshotWriter | None = None
+        with logfire.span("export snapshot to {path}", path=path):
+            async for sections, embeddings in self._scan(batch_size):
+                if writer is None:
+                    writer = SnapshotWriter(path, self.embedder.model, embeddings.shape[-1])
+                writer.write(sections, embeddings)
+            if writer is None:
+                writer = SnapshotWriter(path, self.embedder.model, self.index_dimensions)
+            writer.close()
+        return writer.count
+
+    async def import_snapshot(self, path: str) -> int:
+        """Upsert the sections of a snapshot without re-embedding them; returns their number.
+
+        The snapshot must come from the same embedding model, holding either full embeddings or
+        embeddings already cut to this store's `index_dimensions`.
+        """
+        snapshot = self._open_snapshot(path)
+        with logfire.span("import {count} sections from {path}", count=snapshot.count, path=path):
+            await self._import(snapshot)
+        self.invalidate()
+        return snapshot.count
+
+    def _open_snapshot(self, path: str) -> Snapshot:
+        """The snapshot at `path`, checked to fit this store."""
+        from rag.store.snapshot import Snapshot
+
+        self._check_snapshots()
+        snapshot = Snapshot(path)
+        if snapshot.model != self.embedder.model:
+            raise ValueError(f"snapshot embedded with {snapshot.model}, store uses {self.embedder.model}")
+        if snapshot.dimensions not in (self.embedder.dimensions, self.index_dimensions):
+            raise ValueError(
+                f"snapshot has {snapshot.dimensions} dimensions, expected "
+                f"{self.embedder.dimensions} or {self.index_dimensions}"
+            )
+        return snapshot
+
+    def _diversify(self, query_embedding: list[float] | None, hits: list[Hit], limit: int) -> list[Hit]:
+        if self.mmr_lambda is None or len(hits) <= limit:
+            return hits[:limit]
+        with logfire.span("mmr select {limit} of {count}", limit=limit, count=len(hits)):
+            selected = mmr(query_embedding, [hit.embedding for hit in hits], limit, self.mmr_lambda)
+        return [hits[i] for i in selected]
+
+    def _fetch_limit(self, limit: int) -> int:
+        """How many candidates to search for so every enabled stage has enough to choose from."""
+        fetch = limit
+        if self.reranker is not None:
+            fetch = max(fetch, self.rerank_candidates)
+        if self.mmr_lambda is not None:
+            fetch = max(fetch, limit * self.mmr_fetch_factor)
+        return fetch
+
+    async def _post_process(self, query: str, query_embedding: list[float] | None, hits: list[Hit],
+                            limit: int) -> list[Hit]:
+        if self.reranker is not None:
+            keep = limit * self.mmr_fetch_factor if self.mmr_lambda is not None else limit
+            hits = await self.reranker.rerank(query, hits, keep)
+        return self._diversify(query_embedding, hits, limit)
+
+    async def _retrieve_hits(self, query: str, limit: int, filter: SectionFilter | None=None) -> list[Hit]:
+        diversify = self.mmr_lambda is not None
+        hits = await self.search(query, self._fetch_limit(limit), filter, with_embeddings=diversify)
+        # the query embedding is in `query_cache` by now
+        query_embedding = await self.embed_query(query) if diversify else None
+        return await self._post_process(query, query_embedding, hits, limit)
+
+    async def _retrieve_hits_many(self, queries: list[str], limit: int,
+                                  filter: SectionFilter | None=None) -> list[list[Hit]]:
+        if len(queries) == 1:
+            # a single `search` keeps backend-specific paths such as hybrid ranking
+            return [await self._retrieve_hits(queries[0], limit, filter)]
+        diversify = self.mmr_lambda is not None
+        results = await self.search_many(queries, self._fetch_limit(limit), filter, with_embeddings=diversify)
+        query_embeddings = await self.embed_queries(queries) if diversify else [None] * len(queries)
+        return list(await gather(*(
+            self._post_process(query, query_embedding, hits, limit)
+            for query, query_embedding, hits in zip(queries, query_embeddings, results)
+        )))
+
+    def _result_key(self, limit: int, filter: SectionFilter | None) -> Hashable:
+        """What besides the query must match for `result_cache` to reuse results.
+
+        Covers the post-processing settings too, so changing them never serves stale results.
+        """
+        return (limit, repr(filter), self.reranker, self.rerank_candidates, self.mmr_lambda, self.mmr_fetch_factor)
+
+    async def retrieve_hits(self, query: str, limit: int, filter: SectionFilter | None=None) -> list[Hit]:
+        """Search followed by the configured post-processing stages (reranking, MMR diversification).
+
+        With a `result_cache`, results for a query close enough to an earlier one are reused.
+        """
+        return (await self.retrieve_hits_many([query], limit, filter))[0]
+
+    async def retrieve_hits_many(self, queries: list[str], limit: int,
+                                 filter: SectionFilter | None=None) -> list[list[Hit]]:
+        if self.result_cache is None:
+            return await self._retrieve_hits_many(queries, limit, filter)
+
+        key = self._result_key(limit, filter)
+        query_embeddings = await self.embed_queries(queries)
+        cached = [self.result_cache.get(embedding, key) for embedding in query_embeddings]
+        missing = [i for i, hits in enumerate(cached) if hits is None]
+        fresh: dict[int, list[Hit]] = {}
+        if missing:
+            start = time.perf_counter()
+            results = await self._retrieve_hits_many([queries[i] for i in missing], limit, filter)
+            fresh = dict(zip(missing, results))
+            latency = (time.perf_counter() - start) / len(missing)
+            for i, hits in fresh.items():
+                self.result_cache.put(query_embeddings[i], key, hits, latency)
+        logfire.debug("result cache {hit_rate=} {saved_seconds=}",
+                      hit_rate=self.result_cache.hit_rate, saved_seconds=self.result_cache.saved_seconds)
+        return [hits if hits is not None else fresh[i] for i, hits in enumerate(cached)]
+
+    async def retrieve(self, query: str, limit: int, filter: SectionFilter | None=None) -> str:
+        return format_hits(await self.retrieve_hits(query, limit, filter))
+
+    async def retrieve_many(self, queries: list[str], limit: int,
+                            filter: SectionFilter | None=None) -> list[str]:
+        return [format_hits(hits) for hits in await self.retrieve_hits_many(queries, limit, filter)]
@@ -1,55 +1,233 @@
 from __future__ import annotations as _annotations
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from functools import partial
+from typing import AsyncIterator, Sequence
+
+import asyncio
 
 import chromadb
+from chromadb.api import AsyncClientAPI, ClientAPI
 import logfire
+import numpy as np
+
+from rag.store.base import Section, StoredSection, SectionFilter, Hit, RAGStore, Embedder
+
+
+# Chroma metadata holds scalars only, so each tag becomes its own boolean key
+TAG_PREFIX = "tag:"
 
-from mal.adapter.openai import Embedder
-from rag.store.base import Section, RAGStore
+
+def _where(filter: SectionFilter | None) -> dict | None:
+    if filter is None: return None
+    clauses: list[dict] = []
+    if filter.sources is not None:
+        clauses.append({"source": {"$in": filter.sources}})
+    if filter.langs is not None:
+        clauses.append({"lang": {"$in": filter.langs}})
+    if filter.tags is not None:
+        tags = [{f"{TAG_PREFIX}{tag}": True} for tag in filter.tags]
+        clauses.append(tags[0] if len(tags) == 1 else {"$or": tags})
+    if filter.since is not None:
+        clauses.append({"ingested_at": {"$gte": filter.since.timestamp()}})
+    if filter.until is not None:
+        clauses.append({"ingested_at": {"$lt": filter.until.timestamp()}})
+    if not clauses: return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
 
 
 class ChromaStore(RAGStore):
-    def __init__(self, embedder: Embedder, name: str="documents", path: str="./chromadb") -> None:
-        super().__init__(embedder)
-        self.client = chromadb.PersistentClient(path=path)
-        self.collection = self.client.get_or_create_collection(
-            name=name,
-            metadata={"hnsw:space": "cosine"}
-        )
+    """Chroma-backed store that never blocks the event loop.
+
+    By default it embeds Chroma via `PersistentClient` and runs every call on a dedicated executor
+    of `max_workers` threads. With `host` set it talks to a Chroma server through the async HTTP
+    client instead, which keeps its connections pooled across calls.
+    """
+
+    supports_snapshots = True
+
+    def __init__(self, embedder: Embedder, name: str="documents", path: str="./chromadb",
+                 embed_batch_size: int=64, embed_concurrency: int=4,
+                 index_dimensions: int | None=None,
+                 host: str | None=None, port: int=8000, max_workers: int=4) -> None:
+        super().__init__(embedder, embed_batch_size, embed_concurrency, index_dimensions)
+        self.name = name
+        self.host = host
+        self.port = port
+        # a `PersistentClient` made here, or an `AsyncHttpClient` made by `open` when `host` is set
+        self.client: ClientAPI | AsyncClientAPI | None = None
+        self.collection = None
+        self.max_workers = max_workers
+        self.executor: ThreadPoolExecutor | None = None
+        self.max_batch_size: int | None = None
+        if host is None:
+            self.client = chromadb.PersistentClient(path=path)
+
+    async def open(self) -> None:
+        if self.collection is not None: return
+        if self.host is not None:
+            client = await chromadb.AsyncHttpClient(host=self.host, port=self.port)
+            self.client = client
+            self.collection = await client.get_or_create_collection(
+                name=self.name,
+                metadata={"hnsw:space": "cosine"}
+            )
+            self.max_batch_size = await client.get_max_batch_size()
+        else:
+            client = self.client
+            assert client is not None
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="chroma")
+            self.collection = await self._offload(
+                client.get_or_create_collection,
+                name=self.name,
+                metadata={"hnsw:space": "cosine"}
+            )
+            self.max_batch_size = await self._offload(client.get_max_batch_size)
+
+    async def close(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+        self.collection = None
+
+    async def _offload(self, fn, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, partial(fn, **kwargs))
+
+    async def _call(self, method: str, **kwargs):
+        """Run a collection method without blocking: awaited on the HTTP client, offloaded otherwise."""
+        await self.open()
+        fn = getattr(self.collection, method)
+        if self.host is not None:
+            return await fn(**kwargs)
+        return await self._offload(fn, **kwargs)
+
+    async def _upsert(self, ids: list[str], **columns) -> None:
+        # Chroma rejects writes above its max batch size, so split them
+        await self.open()
+        size = self.max_batch_size or len(ids)
+        for i in range(0, len(ids), size):
+            await self._call(
+                "upsert", ids=ids[i:i+size],
+                **{key: values[i:i+size] for key, values in columns.items()}
+            )
 
-    async def load(self, sections: list[Section]) -> None:
-        with logfire.span("creating embeddings"):
-            embeddings = [
-                await self.embedder.create_embedding(section.embedding_content)
-                for section in sections
+    @staticmethod
+    def _metadata(section: Section, stored: dict[str, dict]) -> dict:
+        return {
+            "uri": section.uri,
+            "title": section.title,
+            "content": section.content,
+            "content_hash": section.content_hash,
+            "meta_hash": section.meta_hash,
+            "source": section.source,
+            "lang": section.lang,
+            "ingested_at": section.ingested_at.timestamp(),
+            # writes merge metadata, so clear tags the section no longer has
+            **{key: False for key in stored.get(section.uri, {}) if key.startswith(TAG_PREFIX)},
+            **{f"{TAG_PREFIX}{tag}": True for tag in section.tags}
+        }
+
+    async def _write(self, sections: Sequence[Section], embeddings, stored: dict[str, dict]) -> None:
+        metadatas = [self._metadata(section, stored) for section in sections]
+        with logfire.span("upsert {count} sections", count=len(sections)):
+            await self._upsert(
+                ids=[section.uri for section in sections],
+                embeddings=self.truncate(embeddings),
+                metadatas=metadatas,
+                documents=[section.content for section in sections]
+            )
+
+    async def _stored(self, sections: Sequence[Section]) -> dict[str, dict]:
+        existing = await self._call("get", ids=[section.uri for section in sections], include=["metadatas"])
+        return {uri: meta or {} for uri, meta in zip(existing["ids"], existing["metadatas"])}
+
+    async def load(self, sections: Sequence[Section], prune: bool=False) -> None:
+        stored = await self._stored(sections)
+        changed, retagged = self._classify(sections, {
+            uri: (meta.get("content_hash", ""), meta.get("meta_hash", "")) for uri, meta in stored.items()
+        })
+
+        if changed:
+            embeddings = await self.create_embeddings([section.embedding_content for section in changed])
+            await self._write(changed, embeddings, stored)
+        if retagged:
+            # metadata only, the stored embeddings stay
+            with logfire.span("update metadata of {count} sections", count=len(retagged)):
+                size = self.max_batch_size or len(retagged)
+                for i in range(0, len(retagged), size):
+                    batch = retagged[i:i+size]
+                    await self._call(
+                        "update", ids=[section.uri for section in batch],
+                        metadatas=[self._metadata(section, stored) for section in batch]
+                    )
+
+        if prune and sections:
+            keep = {section.uri for section in sections}
+            sources = list({section.source for section in sections})
+            scoped = await self._call("get", where={"source": {"$in": sources}}, include=[])
+            stale = [id for id in scoped["ids"] if id not in keep]
+            if stale:
+                with logfire.span("prune {count} sections", count=len(stale)):
+                    size = self.max_batch_size or len(stale)
+                    for i in range(0, len(stale), size):
+                        await self._call("delete", ids=stale[i:i+size])
+        self.invalidate()
+
+    async def _scan(self, batch_size: int) -> AsyncIterator[tuple[list[StoredSection], np.ndarray]]:
+        offset = 0
+        while True:
+            batch = await self._call(
+                "get", limit=batch_size, offset=offset, include=["metadatas", "documents", "embeddings"]
+            )
+            if not batch["ids"]: return
+            sections = [
+                StoredSection(
+                    meta["uri"], meta["title"], doc, "", meta.get("source", ""), meta.get("lang", ""),
+                    [key.removeprefix(TAG_PREFIX) for key, value in meta.items()
+                     if key.startswith(TAG_PREFIX) and value],
+                    datetime.fromtimestamp(meta.get("ingested_at", 0), timezone.utc),
+                    stored_hash=meta.get("content_hash", "")
+                )
+                for meta, doc in zip(batch["metadatas"], batch["documents"])
             ]
-        metadatas = [
-            {
-                "uri": section.uri,
-                "title": section.title,
-                "content": section.content
-            }
-            for section in sections
+            yield sections, np.asarray(batch["embeddings"], dtype=np.float32)
+            offset += len(batch["ids"])
+
+    async def _load_embedded(self, sections: Sequence[Section], embeddings: np.ndarray) -> None:
+        await self._write(sections, embeddings, await self._stored(sections))
+
+    @staticmethod
+    def _hits(ids: list[str], metas: list[dict], docs: list[str], distances: list[float],
+              embeddings: list | None) -> list[Hit]:
+        return [
+            Hit(meta["uri"], meta["title"], doc, distance, id,
+                embeddings[i] if embeddings is not None else None)
+            for i, (id, meta, doc, distance) in enumerate(zip(ids, metas, docs, distances))
         ]
-        self.collection.add(
-            ids=[section.uri for section in sections],
-            embeddings=embeddings,
-            metadatas=metadatas,
-            documents=[section.content for section in sections]
-        )
 
-    async def retrieve(self, query: str, limit: int) -> str:
-        with logfire.span("create embedding for {query=}", query=query):
-            query_embedding = await self.embedder.create_embedding(query)
+    async def search(self, query: str, limit: int, filter: SectionFilter | None=None,
+                     with_embeddings: bool=False) -> list[Hit]:
+        return (await self.search_many([query], limit, filter, with_embeddings))[0]
+
+    async def search_many(self, queries: list[str], limit: int, filter: SectionFilter | None=None,
+                          with_embeddings: bool=False) -> list[list[Hit]]:
+        query_embeddings = self.truncate(await self.embed_queries(queries))
 
-        results = self.collection.query(
-            query_embeddings=[query_embedding],
+        results = await self._call(
+            "query",
+            query_embeddings=query_embeddings,
             n_results=limit,
-            include=["metadatas", "documents"]
+            where=_where(filter),
+            include=["metadatas", "documents", "distances"] + (["embeddings"] if with_embeddings else [])
         )
 
-        if not results: return ""
-            
-        return "\n\n".join(
-            f"# {meta['title']}\nURI:{meta['uri']}\n\n{doc}\n"
-            for meta, doc in zip(results["metadatas"][0], results["documents"][0])
-        )
+        if not results: return [[] for _ in queries]
+
+        embeddings = results["embeddings"] if with_embeddings else [None] * len(queries)
+        return [
+            self._hits(ids, metas, docs, distances, row_embeddings)
+            for ids, metas, docs, distances, row_embeddings in zip(
+                results["ids"], results["metadatas"], results["documents"], results["distances"], embeddings
+            )
+        ]
@@ -0,0 +1,113 @@
+from __future__ import annotations as _annotations
+from typing import Sequence
+
+import asyncio
+
+import logfire
+
+from rag.store.base import Section, SectionFilter, Hit, RAGStore
+
+
+class FederatedStore(RAGStore):
+    """Searches several stores as one, e.g. `logfire_docs` (nomic) and `books` (snowflake).
+
+    The query is embedded once per distinct embedder, members are searched concurrently and a member
+    whose embedding or search fails or exceeds `timeout` seconds is left out, so a slow shard yields
+    partial results rather than stalling the agent. Each member's distances are converted to cosine
+    distances (`RAGStore.cosine_distance`) and merged on that scale, so a member with only weak
+    matches ranks below one with close ones. Different models are not calibrated exactly alike,
+    but their cosine similarities are close enough to rank against each other.
+
+    The federation is read-only: sections are loaded through the members. MMR is not supported,
+    since members may embed into different spaces; reranking is.
+    """
+
+    def __init__(self, stores: list[RAGStore], timeout: float=2.0) -> None:
+        if not stores:
+            raise ValueError("at least one store is required")
+        super().__init__(stores[0].embedder)
+        self.stores = stores
+        self.timeout = timeout
+        # members embed through their own caches, see `_embed_once`
+        self.query_cache = None
+
+    @property
+    def mmr_lambda(self) -> None:
+        return None
+
+    @mmr_lambda.setter
+    def mmr_lambda(self, value: float | None) -> None:
+        if value is not None:
+            raise ValueError("MMR needs comparable embeddings; federated members may use different models")
+
+    async def open(self) -> None:
+        await asyncio.gather(*(store.open() for store in self.stores))
+
+    async def close(self) -> None:
+        await asyncio.gather(*(store.close() for store in self.stores))
+
+    async def load(self, sections: Sequence[Section], prune: bool=False) -> None:
+        """Not supported, the federation is read-only: load sections into the member stores."""
+        raise NotImplementedError("FederatedStore is read-only, load sections into the member stores")
+
+    def _embed_once(self, queries: list[str]) -> dict[int, asyncio.Task]:
+        """Start embedding `queries` once per distinct embedder, seeding every member's query cache.
+
+        Returns the tasks keyed by `id(embedder)`; members await theirs under the timeout.
+        """
+        groups: dict[int, list[RAGStore]] = {}
+        for store in self.stores:
+            groups.setdefault(id(store.embedder), []).append(store)
+
+        async def embed(group: list[RAGStore]) -> None:
+            embeddings = await group[0].embed_queries(queries)
+            for store in group[1:]:
+                if store.query_cache is not None:
+                    for query, embedding in zip(queries, embeddings):
+                        store.query_cache.put(query, embedding)
+
+        return {key: asyncio.create_task(embed(group)) for key, group in groups.items()}
+
+    async def _gather(self, searches) -> list:
+        """Await member searches with the timeout, `None` for members that failed or timed out."""
+        async def bounded(store: RAGStore, search):
+            try:
+                return await asyncio.wait_for(search, self.timeout)
+            except Exception as e:
+                logfire.warn("store {store} skipped: {error!r}", store=type(store).__name__, error=e)
+                return None
+
+        return list(await asyncio.gather(*(bounded(store, search) for store, search in searches)))
+
+    def _merge(self, per_store: list[list[Hit] | None], limit: int) -> list[Hit]:
+        merged: dict[str, Hit] = {}
+        for store, hits in zip(self.stores, per_store):
+            for hit in hits or []:
+                hit.distance = store.cosine_distance(hit.distance)
+                if hit.uri not in merged or hit.distance < merged[hit.uri].distance:
+                    merged[hit.uri] = hit
+        return sorted(merged.values(), key=lambda hit: hit.distance)[:limit]
+
+    async def search(self, query: str, limit: int, filter: SectionFilter | None=None,
+                     with_embeddings: bool=False) -> list[Hit]:
+        return (await self.search_many([query], limit, filter, with_embeddings))[0]
+
+    async def search_many(self, queries: list[str], limit: int, filter: SectionFilter | None=None,
+                          with_embeddings: bool=False) -> list[list[Hit]]:
+        embedded = self._embed_once(queries)
+
+        async def search(store: RAGStore) -> list[list[Hit]]:
+            # shielded: members sharing an embedder must not cancel each other's embedding
+            await asyncio.shield(embedded[id(store.embedder)])
+            return await store.search_many(queries, limit, filter, with_embeddings)
+
+        try:
+            with logfire.span("federated search over {count} stores", count=len(self.stores)):
+                results = await self._gather((store, search(store)) for store in self.stores)
+        finally:
+            for task in embedded.values():
+                task.cancel()
+        return [
+            self._merge([result[i] if result is not None else None for result in results], limit)
+            for i in range(len(queries))
+        ]
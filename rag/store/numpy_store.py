@@ -0,0 +1,307 @@
+from __future__ import annotations as _annotations
+
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import AsyncIterator, Sequence
+
+import io
+import json
+import os
+import sqlite3
+
+import numpy as np
+import logfire
+
+from rag.store.base import Section, StoredSection, SectionFilter, Hit, RAGStore, Embedder
+from rag.vector import normalize
+from rag.store.snapshot import Snapshot
+
+
+META_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sections (
+    idx integer PRIMARY KEY,
+    uri text NOT NULL UNIQUE,
+    title text NOT NULL,
+    content text NOT NULL,
+    content_hash text NOT NULL,
+    meta_hash text NOT NULL DEFAULT '',
+    source text NOT NULL DEFAULT '',
+    lang text NOT NULL DEFAULT '',
+    tags text NOT NULL DEFAULT '[]',
+    ingested_at real NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_sections_source ON sections (source);
+CREATE INDEX IF NOT EXISTS idx_sections_lang ON sections (lang);
+CREATE INDEX IF NOT EXISTS idx_sections_ingested_at ON sections (ingested_at);
+"""
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the `k` highest scores along the last axis, best first."""
+    k = min(k, scores.shape[-1])
+    if k <= 0:
+        return np.empty(scores.shape[:-1] + (0,), dtype=np.intp)
+    part = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+    order = np.argsort(-np.take_along_axis(scores, part, axis=-1), axis=-1)
+    return np.take_along_axis(part, order, axis=-1)
+
+
+class NumpyStore(RAGStore):
+    """In-process vector store: a memory-mapped float32 `.npy` matrix plus a SQLite sidecar.
+
+    Embeddings are L2-normalized on write, so cosine similarity is a single matrix-vector product.
+    Row `i` of the matrix belongs to the sidecar row with `idx = i`.
+    """
+
+    supports_snapshots = True
+
+    def __init__(self, embedder: Embedder, name: str="documents", path: str="./npstore",
+                 embed_batch_size: int=64, embed_concurrency: int=4,
+                 index_dimensions: int | None=None) -> None:
+        super().__init__(embedder, embed_batch_size, embed_concurrency, index_dimensions)
+        root = Path(path)
+        root.mkdir(parents=True, exist_ok=True)
+        self.matrix_path = root / f"{name}.npy"
+        self.meta = sqlite3.connect(root / f"{name}.sqlite")
+        self.meta.executescript(META_SCHEMA)
+        if "meta_hash" not in {row[1] for row in self.meta.execute("PRAGMA table_info(sections)")}:
+            self.meta.execute("ALTER TABLE sections ADD COLUMN meta_hash text NOT NULL DEFAULT ''")
+        self.matrix = self._open_matrix()
+
+    def _open_matrix(self) -> np.ndarray:
+        if not self.matrix_path.exists():
+            return np.empty((0, self.index_dimensions), dtype=np.float32)
+        matrix = np.load(self.matrix_path, mmap_mode="r")
+        if matrix.dtype != np.float32 or matrix.ndim != 2 or matrix.shape[1] != self.index_dimensions:
+            raise ValueError(
+                f"{self.matrix_path} holds {matrix.dtype} embeddings of shape {matrix.shape}, "
+                f"expected float32 with {self.index_dimensions} dimensions"
+            )
+        return matrix
+
+    def _write_matrix(self, rows: int, fill) -> None:
+        """Write a new matrix of `rows` rows via `fill(out)` and atomically swap it in."""
+        tmp = self.matrix_path.with_suffix(".tmp.npy")
+        out = np.lib.format.open_memmap(
+            tmp, mode="w+", dtype=np.float32, shape=(rows, self.index_dimensions)
+        )
+        fill(out)
+        out.flush()
+        del out
+        os.replace(tmp, self.matrix_path)
+        self.matrix = self._open_matrix()
+
+    def _append_matrix(self, embeddings: np.ndarray) -> bool:
+        """Grow the matrix file in place by `embeddings` rows.
+
+        The rows are written past the current end before the header is updated, so a crash in
+        between leaves the old matrix intact. Returns False when the header cannot be rewritten
+        in place (no file yet, or the new shape would need a longer header).
+        """
+        if not self.matrix_path.exists(): return False
+        fmt = np.lib.format
+        with open(self.matrix_path, "r+b") as f:
+            version = fmt.read_magic(f)
+            read_header = fmt.read_array_header_1_0 if version == (1, 0) else fmt.read_array_header_2_0
+            shape, fortran_order, dtype = read_header(f)
+            if len(shape) != 2 or shape[1] != embeddings.shape[1] or dtype != np.float32:
+                raise ValueError(
+                    f"cannot append {embeddings.shape[1]} dimensional rows to {self.matrix_path} "
+                    f"of {dtype} and shape {shape}"
+                )
+            offset = f.tell()
+            header = io.BytesIO()
+            write_header = fmt.write_array_header_1_0 if version == (1, 0) else fmt.write_array_header_2_0
+            write_header(header, {
+                "descr": fmt.dtype_to_descr(dtype), "fortran_order": fortran_order,
+                "shape": (shape[0] + embeddings.shape[0], shape[1]),
+            })
+            if fortran_order or len(header.getvalue()) != offset:
+                return False
+
+            f.seek(offset + shape[0] * shape[1] * dtype.itemsize)
+            f.write(np.ascontiguousarray(embeddings, dtype=dtype).tobytes())
+            f.truncate()
+            f.flush()
+            os.fsync(f.fileno())
+            f.seek(0)
+            f.write(header.getvalue())
+        self.matrix = self._open_matrix()
+        return True
+
+    async def load(self, sections: Sequence[Section], prune: bool=False) -> None:
+        existing = {
+            uri: (idx, content_hash, meta_hash)
+            for idx, uri, content_hash, meta_hash in self.meta.execute(
+                "SELECT idx, uri, content_hash, meta_hash FROM sections"
+            )
+        }
+        changed, retagged = self._classify(
+            sections, {uri: (content_hash, meta_hash) for uri, (_, content_hash, meta_hash) in existing.items()}
+        )
+
+        if changed:
+            embeddings = normalize(self.truncate(
+                await self.create_embeddings([section.embedding_content for section in changed])
+            ))
+            n = self.matrix.shape[0]
+            rows = []
+            for section in changed:
+                if section.uri in existing:
+                    rows.append(existing[section.uri][0])
+                else:
+                    rows.append(n)
+                    n += 1
+
+            def fill(out: np.ndarray) -> None:
+                out[:self.matrix.shape[0]] = self.matrix
+                out[rows] = embeddings
+
+            with logfire.span("write {count} embeddings", count=len(changed)):
+                # pure appends grow the file; updates of existing rows rewrite it
+                updates = any(section.uri in existing for section in changed)
+                if updates or not self._append_matrix(embeddings):
+                    self._write_matrix(n, fill)
+                self._put_meta(rows, changed)
+                self.meta.commit()
+        if retagged:
+            self._put_meta([existing[section.uri][0] for section in retagged], retagged)
+            self.meta.commit()
+
+        if prune:
+            self._prune({section.uri for section in sections}, {section.source for section in sections})
+        self.invalidate()
+
+    def _put_meta(self, rows: list[int], sections: Sequence[Section]) -> None:
+        self.meta.executemany(
+            "INSERT INTO sections "
+            "(idx, uri, title, content, content_hash, meta_hash, source, lang, tags, ingested_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (uri) DO UPDATE SET title = excluded.title, content = excluded.content, "
+            "content_hash = excluded.content_hash, meta_hash = excluded.meta_hash, "
+            "source = excluded.source, lang = excluded.lang, "
+            "tags = excluded.tags, ingested_at = excluded.ingested_at",
+            [
+                (idx, section.uri, section.title, section.content, section.content_hash, section.meta_hash,
+                 section.source, section.lang, json.dumps(section.tags),
+                 section.ingested_at.timestamp())
+                for idx, section in zip(rows, sections)
+            ]
+        )
+
+    def _prune(self, keep: set[str], sources: set[str]) -> None:
+        """Delete the sections of `sources` whose URI is not in `keep`."""
+        rows = self.meta.execute("SELECT idx, uri, source FROM sections ORDER BY idx").fetchall()
+        stale = {uri for _, uri, source in rows if source in sources and uri not in keep}
+        if not stale: return
+
+        with logfire.span("prune {count} sections", count=len(stale)):
+            kept = [idx for idx, uri, _ in rows if uri not in stale]
+            self._write_matrix(len(kept), lambda out: np.take(self.matrix, kept, axis=0, out=out))
+            self.meta.executemany("DELETE FROM sections WHERE uri = ?", [(uri,) for uri in stale])
+            # renumbering in ascending order never collides: every target slot is already vacated
+            self.meta.executemany(
+                "UPDATE sections SET idx = ? WHERE idx = ?",
+                [(new, old) for new, old in enumerate(kept) if new != old]
+            )
+            self.meta.commit()
+
+    async def _scan(self, batch_size: int) -> AsyncIterator[tuple[list[StoredSection], np.ndarray]]:
+        cursor = self.meta.execute(
+            "SELECT idx, uri, title, content, content_hash, source, lang, tags, ingested_at "
+            "FROM sections ORDER BY idx"
+        )
+        while rows := cursor.fetchmany(batch_size):
+            sections = [
+                StoredSection(uri, title, content, "", source, lang, json.loads(tags),
+                              datetime.fromtimestamp(ingested_at, timezone.utc), stored_hash=content_hash)
+                for _, uri, title, content, content_hash, source, lang, tags, ingested_at in rows
+            ]
+            yield sections, np.asarray(self.matrix[[row[0] for row in rows]])
+
+    async def _import(self, snapshot: Snapshot) -> None:
+        existing = {uri: idx for idx, uri in self.meta.execute("SELECT idx, uri FROM sections")}
+        # a first pass over the URIs sizes the new matrix, the second streams the vectors into it
+        n = self.matrix.shape[0]
+        for name in snapshot.names:
+            for uri in snapshot.columns(name)["uri"]:
+                if uri not in existing:
+                    existing[uri] = n
+                    n += 1
+
+        def fill(out: np.ndarray) -> None:
+            out[:self.matrix.shape[0]] = self.matrix
+            for sections, embeddings in snapshot.chunks():
+                rows = [existing[section.uri] for section in sections]
+                out[rows] = normalize(self.truncate(embeddings))
+                self._put_meta(rows, sections)
+
+        self._write_matrix(n, fill)
+        self.meta.commit()
+
+    def _hits(self, indices: list[int], scores: list[float], with_embeddings: bool=False) -> list[Hit]:
+        if not indices: return []
+        placeholders = ",".join("?" * len(indices))
+        found = {
+            idx: (uri, title, content)
+            for idx, uri, title, content in self.meta.execute(
+                f"SELECT idx, uri, title, content FROM sections WHERE idx IN ({placeholders})", indices
+            )
+        }
+        # embeddings are normalized, so cosine distance is 1 - dot product
+        return [
+            Hit(*found[idx], distance=1.0 - score, id=idx,
+                embedding=np.array(self.matrix[idx]) if with_embeddings else None)
+            for idx, score in zip(indices, scores)
+        ]
+
+    def _mask(self, filter: SectionFilter | None) -> np.ndarray | None:
+        """Boolean mask over matrix rows passing `filter`, `None` when nothing is filtered."""
+        if filter is None: return None
+        clauses: list[str] = []
+        args: list = []
+        for column, values in (("source", filter.sources), ("lang", filter.langs)):
+            if values is not None:
+                clauses.append(f"{column} IN ({','.join('?' * len(values))})")
+                args.extend(values)
+        if filter.tags is not None:
+            clauses.append(
+                f"EXISTS (SELECT 1 FROM json_each(tags) WHERE value IN ({','.join('?' * len(filter.tags))}))"
+            )
+            args.extend(filter.tags)
+        if filter.since is not None:
+            clauses.append("ingested_at >= ?")
+            args.append(filter.since.timestamp())
+        if filter.until is not None:
+            clauses.append("ingested_at < ?")
+            args.append(filter.until.timestamp())
+        if not clauses: return None
+
+        mask = np.zeros(self.matrix.shape[0], dtype=bool)
+        rows = self.meta.execute(f"SELECT idx FROM sections WHERE {' AND '.join(clauses)}", args).fetchall()
+        mask[[idx for idx, in rows]] = True
+        return mask
+
+    async def search(self, query: str, limit: int, filter: SectionFilter | None=None,
+                     with_embeddings: bool=False) -> list[Hit]:
+        return (await self.search_many([query], limit, filter, with_embeddings))[0]
+
+    async def search_many(self, queries: list[str], limit: int, filter: SectionFilter | None=None,
+                          with_embeddings: bool=False) -> list[list[Hit]]:
+        if not queries: return []
+        query_embeddings = normalize(self.truncate(await self.embed_queries(queries)))
+        mask = self._mask(filter)
+
+        with logfire.span("search {rows} rows for {count} queries",
+                          rows=self.matrix.shape[0], count=len(queries)):
+            scores = query_embeddings @ self.matrix.T
+            if mask is not None:
+                scores[:, ~mask] = -np.inf
+                limit = min(limit, int(mask.sum()))
+            indices = top_k(scores, limit)
+            top_scores = np.take_along_axis(scores, indices, axis=-1)
+
+        return [
+            self._hits(row, row_scores, with_embeddings)
+            for row, row_scores in zip(indices.tolist(), top_scores.tolist())
+        ]
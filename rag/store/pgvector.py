@@ -1,15 +1,18 @@
 from __future__ import annotations as _annotations
 from contextlib import asynccontextmanager
-from typing_extensions import AsyncGenerator
+from contextvars import ContextVar
+from typing_extensions import AsyncGenerator, AsyncIterator, Hashable, Sequence
 
-from asyncio import Semaphore, TaskGroup
+import copy
+import re
+import struct
 
-import pydantic_core
+import numpy as np
 import logfire
 import asyncpg
 
-from mal.adapter.openai import Embedder
-from rag.store.base import Section, RAGStore
+from rag.store.base import Section, StoredSection, SectionFilter, Hit, RAGStore, Embedder, format_hits
+from rag.store.snapshot import Snapshot
 
 
 DB_SCHEMA = """
@@ -20,21 +23,293 @@ CREATE TABLE IF NOT EXISTS {table} (
     uri text NOT NULL UNIQUE,
     title text NOT NULL,
     content text NOT NULL,
+    content_hash text NOT NULL DEFAULT '',
+    meta_hash text NOT NULL DEFAULT '',
+    source text NOT NULL DEFAULT '',
+    lang text NOT NULL DEFAULT '',
+    tags text[] NOT NULL DEFAULT '{{}}',
+    ingested_at timestamptz NOT NULL DEFAULT now(),
     embedding vector({dimensions}) NOT NULL
 );
-CREATE INDEX IF NOT EXISTS idx_{table}_embeddings ON {table} USING hnsw (embedding vector_l2_ops);
+ALTER TABLE {table} ADD COLUMN IF NOT EXISTS content_hash text NOT NULL DEFAULT '';
+ALTER TABLE {table} ADD COLUMN IF NOT EXISTS meta_hash text NOT NULL DEFAULT '';
+ALTER TABLE {table}
+    ADD COLUMN IF NOT EXISTS source text NOT NULL DEFAULT '',
+    ADD COLUMN IF NOT EXISTS lang text NOT NULL DEFAULT '',
+    ADD COLUMN IF NOT EXISTS tags text[] NOT NULL DEFAULT '{{}}',
+    ADD COLUMN IF NOT EXISTS ingested_at timestamptz NOT NULL DEFAULT now();
+CREATE INDEX IF NOT EXISTS idx_{table}_source ON {table} (source);
+CREATE INDEX IF NOT EXISTS idx_{table}_lang ON {table} (lang);
+CREATE INDEX IF NOT EXISTS idx_{table}_ingested_at ON {table} (ingested_at);
+CREATE INDEX IF NOT EXISTS idx_{table}_tags ON {table} USING gin (tags);
 """
 
+# full-text column for hybrid search, only created with `full_text` since adding it rewrites the
+# table and every write then pays for `to_tsvector` and the GIN index
+DB_FULL_TEXT = """
+ALTER TABLE {table} ADD COLUMN IF NOT EXISTS content_tsv tsvector
+    GENERATED ALWAYS AS (to_tsvector('{ts_config}'::regconfig, title || ' ' || content)) STORED;
+CREATE INDEX IF NOT EXISTS idx_{table}_content_tsv ON {table} USING gin (content_tsv);
+"""
+
+# full-precision, untruncated vectors kept next to a truncated `embedding` for re-scoring
+DB_FULL_EMBEDDING = """
+ALTER TABLE {table} ADD COLUMN IF NOT EXISTS embedding_full vector({dimensions});
+"""
+
+# reciprocal rank fusion of the ANN and full-text candidate lists, in one round trip
+# $1 query embedding, $2 query text, $3 candidates per list, $4 lexical weight, $5 limit,
+# $6 full query embedding when re-scoring against `embedding_full`, then filter parameters
+HYBRID_QUERY = """
+WITH semantic AS (
+    SELECT id, row_number() OVER (ORDER BY distance) AS rank FROM ({nearest}) n
+), lexical AS (
+    SELECT id, row_number() OVER (ORDER BY ts_rank_cd(content_tsv, q) DESC) AS rank
+    FROM {table}, websearch_to_tsquery('{ts_config}'::regconfig, $2) q
+    WHERE content_tsv @@ q{filter}
+    ORDER BY ts_rank_cd(content_tsv, q) DESC LIMIT $3
+), fused AS (
+    SELECT coalesce(s.id, l.id) AS id,
+           coalesce((1 - $4::float8) / ({rrf_k} + s.rank), 0)
+           + coalesce($4::float8 / ({rrf_k} + l.rank), 0) AS score
+    FROM semantic s FULL OUTER JOIN lexical l ON s.id = l.id
+)
+SELECT t.id, t.uri, t.title, t.content, {distance} AS distance{embedding}
+FROM fused JOIN {table} t ON t.id = fused.id
+ORDER BY fused.score DESC LIMIT $5
+"""
+
+DB_INDEX = """
+CREATE INDEX IF NOT EXISTS {index} ON {table} USING hnsw ({ops});
+"""
+
+# what the HNSW index is built over: full vectors, half precision, or binary quantized bits;
+# the `embedding` column itself always stays float32 for re-scoring
+INDEX_OPS = {
+    "none": "embedding vector_l2_ops",
+    "halfvec": "(embedding::halfvec({dimensions})) halfvec_l2_ops",
+    "binary": "(binary_quantize(embedding)::bit({dimensions})) bit_hamming_ops",
+}
+
+# one nearest-neighbour search per query embedding, all in a single statement
+# $1 query embeddings, $2 limit, $3 full query embeddings when re-scoring against `embedding_full`,
+# then filter parameters
+MULTI_QUERY = """
+SELECT q.ord, t.*
+FROM {unnest} WITH ORDINALITY AS q({columns}, ord)
+CROSS JOIN LATERAL ({nearest}) t
+ORDER BY q.ord, t.distance
+"""
+
+
+# `lexical_weight` of the `retrieve` call in progress, overriding the store setting in `search`
+_retrieve_weight: ContextVar[float | None] = ContextVar("retrieve_weight", default=None)
+
+
+## binary codecs for pgvector types
+# wire format: int16 dimensions, int16 unused, then big-endian float32 (`vector`) or float16 (`halfvec`)
+
+_HEADER = struct.Struct(">HH")
+
+
+def encode_vector(value, dtype: str=">f4") -> bytes:
+    """Encode a vector to the wire format up front, e.g. for elements of a `vector[]` parameter."""
+    arr = np.asarray(value, dtype=dtype)
+    return _HEADER.pack(arr.shape[0], 0) + arr.tobytes()
+
+
+def _vector_encoder(dtype: str):
+    def encode(value) -> bytes:
+        # pre-encoded values pass through; asyncpg would otherwise take a list element of an
+        # array parameter for a nested sub-array
+        if isinstance(value, bytes):
+            return value
+        return encode_vector(value, dtype)
+    return encode
+
+
+def _vector_decoder(dtype: str, as_numpy: bool):
+    def decode(data: bytes):
+        # a read-only view over the received buffer, no copy
+        arr = np.frombuffer(data, dtype=dtype, offset=_HEADER.size)
+        return arr if as_numpy else arr.tolist()
+    return decode
+
+
+async def register_vector_codecs(conn: asyncpg.Connection, as_numpy: bool=False) -> None:
+    """Register binary codecs for `vector` and, where available, `halfvec` on `conn`.
+
+    Parameters may be passed as lists or NumPy arrays; with `as_numpy` results are returned as
+    zero-copy float arrays instead of lists.
+    """
+    schema = await conn.fetchval(
+        "SELECT n.nspname FROM pg_extension e JOIN pg_namespace n ON n.oid = e.extnamespace "
+        "WHERE e.extname = 'vector'"
+    )
+    if schema is None:
+        raise RuntimeError("pgvector extension is not installed")
+    for type_name, dtype in (("vector", ">f4"), ("halfvec", ">f2")):
+        try:
+            await conn.set_type_codec(
+                type_name, schema=schema, format="binary",
+                encoder=_vector_encoder(dtype), decoder=_vector_decoder(dtype, as_numpy)
+            )
+        except ValueError:
+            # `halfvec` needs pgvector 0.7+
+            logfire.info("type {type_name} not available", type_name=type_name)
+
 
 class PgVectorStore(RAGStore):
-    def __init__(self, embedder: Embedder, dsn: str, db: str, table: str) -> None:
-        super().__init__(embedder)
+    supports_snapshots = True
+
+    def __init__(self, embedder: Embedder, dsn: str, db: str, table: str,
+                 embed_batch_size: int=64, embed_concurrency: int=4, as_numpy: bool=False,
+                 lexical_weight: float=0.0, ts_config: str="simple",
+                 quantization: str="none", rescore_factor: int=4,
+                 index_dimensions: int | None=None, keep_full: bool=False,
+                 versioned: bool=False, full_text: bool=False) -> None:
+        super().__init__(embedder, embed_batch_size, embed_concurrency, index_dimensions)
+        if quantization not in INDEX_OPS:
+            raise ValueError(f"unknown quantization: {quantization}")
         self.dsn = dsn
         self.db = db
         self.table = table
+        self.as_numpy = as_numpy
+        # default weight of full-text matches in `retrieve`, 0 means vector search only
+        self.lexical_weight = lexical_weight
+        # whether the full-text column hybrid search needs exists, implied by a `lexical_weight`
+        self.full_text = full_text or lexical_weight > 0
+        self.ts_config = ts_config
+        # `binary` searches the bit index for `limit * rescore_factor` candidates and re-ranks them
+        # by full-precision distance, a larger factor trades latency for recall
+        self.quantization = quantization
+        self.rescore_factor = rescore_factor
+        # with truncated `index_dimensions`, optionally keep full vectors and re-rank candidates by them
+        self.keep_full = keep_full and self.index_dimensions < embedder.dimensions
+        # with `versioned`, `table` is a view over `{table}_v{n}` tables, see `rebuild`
+        self.versioned = versioned
+        # whether this is a `rebuild` build table, which is dropped rather than repaired when its load fails
+        self.shadow = False
+        self.pool: asyncpg.Pool | None = None
+        # whether pgvector supports `hnsw.iterative_scan` (0.8+), checked as connections open
+        self.iterative_scan = False
+
+    @property
+    def _index_name(self) -> str:
+        suffix = "" if self.quantization == "none" else f"_{self.quantization}"
+        return f"idx_{self.table}_embeddings{suffix}"
+
+    @property
+    def _index_sql(self) -> str:
+        ops = INDEX_OPS[self.quantization].format(dimensions=self.index_dimensions)
+        return DB_INDEX.format(index=self._index_name, table=self.table, ops=ops)
+
+    def _distance_sql(self, query_embedding: str, full_query_embedding: str, prefix: str="") -> str:
+        if self.keep_full:
+            return f"{prefix}embedding_full <-> {full_query_embedding}"
+        return f"{prefix}embedding <-> {query_embedding}"
+
+    @staticmethod
+    def _filter_sql(filter: SectionFilter | None, first_param: int) -> tuple[list[str], list]:
+        """SQL predicates for `filter`, numbering their parameters from `first_param`."""
+        clauses: list[str] = []
+        args: list = []
+        if filter is None:
+            return clauses, args
+
+        def param(value, cast: str="") -> str:
+            args.append(value)
+            return f"${first_param + len(args) - 1}{cast}"
+
+        if filter.sources is not None:
+            clauses.append(f"source = ANY({param(filter.sources, '::text[]')})")
+        if filter.langs is not None:
+            clauses.append(f"lang = ANY({param(filter.langs, '::text[]')})")
+        if filter.tags is not None:
+            clauses.append(f"tags && {param(filter.tags, '::text[]')}")
+        if filter.since is not None:
+            clauses.append(f"ingested_at >= {param(filter.since, '::timestamptz')}")
+        if filter.until is not None:
+            clauses.append(f"ingested_at < {param(filter.until, '::timestamptz')}")
+        return clauses, args
+
+    def _embedding_sql(self, prefix: str="") -> str:
+        """Select-list entry returning the stored vector of each hit as `hit_embedding`."""
+        column = "embedding_full" if self.keep_full else "embedding"
+        return f", {prefix}{column} AS hit_embedding"
+
+    def _nearest_sql(self, query_embedding: str, limit: str, full_query_embedding: str,
+                     filters: list[str] | None=None, with_embeddings: bool=False) -> str:
+        """Nearest-neighbour subquery over the configured index, yielding hits with `distance`.
+
+        Candidates from a binary index, or from a truncated index with `keep_full`, are re-ranked
+        by the exact distance on the best vectors stored.
+        """
+        columns = (
+            f"id, uri, title, content, "
+            f"{self._distance_sql(query_embedding, full_query_embedding)} AS distance"
+        )
+        if with_embeddings:
+            columns += self._embedding_sql()
+        dimensions = self.index_dimensions
+        if self.quantization == "halfvec":
+            order = f"embedding::halfvec({dimensions}) <-> {query_embedding}::halfvec({dimensions})"
+        elif self.quantization == "binary":
+            order = (
+                f"binary_quantize(embedding)::bit({dimensions}) "
+                f"<~> binary_quantize({query_embedding})::bit({dimensions})"
+            )
+        else:
+            order = f"embedding <-> {query_embedding}"
+        where = f" WHERE {' AND '.join(filters)}" if filters else ""
+
+        if self.quantization == "binary" or self.keep_full:
+            return (
+                f"SELECT * FROM (SELECT {columns} FROM {self.table}{where} ORDER BY {order} "
+                f"LIMIT {limit} * {int(self.rescore_factor)}) c ORDER BY distance LIMIT {limit}"
+            )
+        return f"SELECT {columns} FROM {self.table}{where} ORDER BY {order} LIMIT {limit}"
+
+    @property
+    def _retrieve_sql(self) -> str:
+        return self._nearest_sql("$1::vector", "$2", "$3::vector")
+
+    def _query_args(self, embedding) -> tuple:
+        """The truncated query embedding, plus the full one when re-scoring."""
+        truncated = self.truncate(embedding)
+        return (truncated, np.asarray(embedding, dtype=np.float32)) if self.keep_full else (truncated,)
+
+    async def _init_connection(self, conn: asyncpg.Connection) -> None:
+        await register_vector_codecs(conn, self.as_numpy)
+        version = await conn.fetchval("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+        self.iterative_scan = tuple(int(part) for part in re.findall(r"\d+", version)[:2]) >= (0, 8)
+        # warm the per-connection statement cache so the first retrieval skips the PREPARE round trip
+        query, *full = self._query_args(np.zeros(self.embedder.dimensions, dtype=np.float32))
+        try:
+            await conn.fetch(self._retrieve_sql, query, 0, *full)
+        except asyncpg.PostgresError:
+            # best effort: the table or a column such as `embedding_full` may not exist until
+            # `_create_schema` runs on this very pool
+            pass
+
+    async def open(self) -> None:
+        """Open a long-lived pool shared by all subsequent `load` and `retrieve` calls."""
+        if self.pool is None:
+            self.pool = await asyncpg.create_pool(
+                f"{self.dsn}/{self.db}", init=self._init_connection
+            )
+
+    async def close(self) -> None:
+        if self.pool is not None:
+            pool, self.pool = self.pool, None
+            await pool.close()
 
     @asynccontextmanager
     async def _connect(self, create_db: bool=False) -> AsyncGenerator[asyncpg.Pool, None]:
+        if self.pool is not None:
+            yield self.pool
+            return
+
         if create_db:
             with logfire.span("check and create database"):
                 conn = await asyncpg.connect(f"{self.dsn}/postgres")
@@ -47,57 +322,488 @@ class PgVectorStore(RAGStore):
                 finally:
                     await conn.close()
 
-        pool = await asyncpg.create_pool(f"{self.dsn}/{self.db}")
+                # the extension must exist before pool connections register the vector codecs
+                conn = await asyncpg.connect(f"{self.dsn}/{self.db}")
+                try:
+                    await conn.execute("CREATE EXTENSION IF NOT EXISTS vector")
+                finally:
+                    await conn.close()
+
+        pool = await asyncpg.create_pool(f"{self.dsn}/{self.db}", init=self._init_connection)
         try:
             yield pool
         finally:
             await pool.close()
 
-    async def load(self, sections: list[Section]) -> None:
-        db_schema = DB_SCHEMA.format(table=self.table, dimensions=self.embedder.dimensions)
+    async def _create_schema(self, pool: asyncpg.Pool, with_index: bool=True) -> None:
+        db_schema = DB_SCHEMA.format(table=self.table, dimensions=self.index_dimensions)
+        if self.full_text:
+            db_schema += DB_FULL_TEXT.format(table=self.table, ts_config=self.ts_config)
+        if self.keep_full:
+            db_schema += DB_FULL_EMBEDDING.format(table=self.table, dimensions=self.embedder.dimensions)
+        if with_index:
+            db_schema += self._index_sql
+        with logfire.span("create schema"):
+            async with pool.acquire() as conn:
+                async with conn.transaction():
+                    await conn.execute(db_schema)
+
+    async def _diff(self, pool: asyncpg.Pool, sections: Sequence[Section],
+                    fetch_all: bool=False) -> tuple[list[Section], list[Section]]:
+        """Split off the sections to (re-)embed and those whose metadata alone changed."""
+        with logfire.span("check existing sections"):
+            if fetch_all:
+                rows = await pool.fetch(f"SELECT uri, content_hash, meta_hash FROM {self.table}")
+            else:
+                rows = await pool.fetch(
+                    f"SELECT uri, content_hash, meta_hash FROM {self.table} WHERE uri = ANY($1::text[])",
+                    [section.uri for section in sections]
+                )
+        return self._classify(sections, {row["uri"]: (row["content_hash"], row["meta_hash"]) for row in rows})
+
+    async def _retag(self, pool: asyncpg.Pool, sections: Sequence[Section]) -> None:
+        """Update the metadata of sections whose text is unchanged, without re-embedding them."""
+        with logfire.span("update metadata of {count} sections", count=len(sections)):
+            await pool.executemany(
+                f"UPDATE {self.table} SET source = $2, lang = $3, tags = $4, meta_hash = $5 WHERE uri = $1",
+                [
+                    (section.uri, section.source, section.lang, section.tags, section.meta_hash)
+                    for section in sections
+                ]
+            )
+
+    async def _prune(self, pool: asyncpg.Pool, sections: Sequence[Section]) -> None:
+        with logfire.span("prune sections missing from input"):
+            status = await pool.execute(
+                f"DELETE FROM {self.table} WHERE source = ANY($1::text[]) AND NOT (uri = ANY($2::text[]))",
+                list({section.source for section in sections}), [section.uri for section in sections]
+            )
+            logfire.info("pruned: {status}", status=status)
+
+    @property
+    def _columns(self) -> list[str]:
+        columns = [
+            "uri", "title", "content", "content_hash", "meta_hash", "source", "lang", "tags", "ingested_at",
+            "embedding"
+        ]
+        return columns + ["embedding_full"] if self.keep_full else columns
+
+    @property
+    def _upsert_clause(self) -> str:
+        updates = ", ".join(f"{column} = EXCLUDED.{column}" for column in self._columns[1:])
+        return f"ON CONFLICT (uri) DO UPDATE SET {updates}"
+
+    def _records(self, sections: Sequence[Section], embeddings: list[list[float]] | np.ndarray) -> list[tuple]:
+        truncated = self.truncate(embeddings)
+        return [
+            (section.uri, section.title, section.content, section.content_hash, section.meta_hash,
+             section.source, section.lang, section.tags, section.ingested_at, index_embedding)
+            + ((embedding,) if self.keep_full else ())
+            for section, embedding, index_embedding in zip(sections, embeddings, truncated)
+        ]
+
+    async def load(self, sections: Sequence[Section], prune: bool=False) -> None:
+        if self.versioned:
+            current = await self._current_version()
+            if current is None:
+                await self.rebuild(sections)
+            else:
+                await current.load(sections, prune)
+                await self._refresh_view(current)
+            return
+
         async with self._connect(True) as pool:
-            with logfire.span("create schema"):
+            await self._create_schema(pool)
+
+            changed, retagged = await self._diff(pool, sections)
+            if changed:
+                embeddings = await self.create_embeddings(
+                    [section.embedding_content for section in changed]
+                )
+                columns = self._columns
+                params = ", ".join(f"${i}" for i in range(1, len(columns) + 1))
+                with logfire.span("upsert {count} sections", count=len(changed)):
+                    await pool.executemany(
+                        f"INSERT INTO {self.table} ({', '.join(columns)}) "
+                        f"VALUES ({params}) {self._upsert_clause}",
+                        self._records(changed, embeddings)
+                    )
+            if retagged:
+                await self._retag(pool, retagged)
+            if prune:
+                await self._prune(pool, sections)
+        self.invalidate()
+
+    @asynccontextmanager
+    async def _bulk(self, rebuild_index: bool, maintenance_work_mem: str,
+                    parallel_workers: int) -> AsyncGenerator[asyncpg.Pool, None]:
+        """Pool for a bulk write, with the HNSW index dropped first and rebuilt once at the end.
+
+        When the write fails the index is still rebuilt, so readers never fall back to sequential
+        scans, unless this is a `shadow` table that `rebuild` is about to drop. A failure to build it
+        then is logged, the write's own exception is the one raised.
+        """
+        async with self._connect(True) as pool:
+            await self._create_schema(pool, with_index=not rebuild_index)
+            if rebuild_index:
+                with logfire.span("drop index"):
+                    await pool.execute(f"DROP INDEX IF EXISTS {self._index_name}")
+
+            try:
+                yield pool
+            except BaseException:
+                if rebuild_index and not self.shadow:
+                    try:
+                        await self._build_index(pool, maintenance_work_mem, parallel_workers)
+                    except Exception:
+                        logfire.exception("rebuilding {index} after a failed load", index=self._index_name)
+                raise
+            else:
+                if rebuild_index:
+                    await self._build_index(pool, maintenance_work_mem, parallel_workers)
+            finally:
+                self.invalidate()
+
+    async def _build_index(self, pool: asyncpg.Pool, maintenance_work_mem: str, parallel_workers: int) -> None:
+        with logfire.span("build index"):
+            async with pool.acquire() as conn:
+                await conn.execute(f"SET maintenance_work_mem = '{maintenance_work_mem}'")
+                await conn.execute(f"SET max_parallel_maintenance_workers = {int(parallel_workers)}")
+                try:
+                    await conn.execute(self._index_sql)
+                finally:
+                    await conn.execute("RESET maintenance_work_mem")
+                    await conn.execute("RESET max_parallel_maintenance_workers")
+
+    async def bulk_load(self, sections: Sequence[Section], prune: bool=False, copy_batch_size: int=10_000,
+                        rebuild_index: bool=False, maintenance_work_mem: str="1GB",
+                        parallel_workers: int=4) -> None:
+        """Load a large number of sections through `COPY`.
+
+        Existing URIs and content hashes are fetched once up front, new or changed sections are
+        embedded and copied in batches of `copy_batch_size`. With `rebuild_index` the HNSW index is
+        dropped before the load and built once afterwards, which is far cheaper than maintaining it
+        row by row.
+        """
+        if self.versioned:
+            current = await self._current_version()
+            if current is None:
+                await self.rebuild(sections, copy_batch_size=copy_batch_size,
+                                   maintenance_work_mem=maintenance_work_mem, parallel_workers=parallel_workers)
+            else:
+                await current.bulk_load(sections, prune, copy_batch_size, rebuild_index,
+                                        maintenance_work_mem, parallel_workers)
+                await self._refresh_view(current)
+            return
+
+        async with self._bulk(rebuild_index, maintenance_work_mem, parallel_workers) as pool:
+            changed, retagged = await self._diff(pool, sections, fetch_all=True)
+            for i in range(0, len(changed), copy_batch_size):
+                batch = changed[i:i+copy_batch_size]
+                embeddings = await self.create_embeddings([section.embedding_content for section in batch])
+                with logfire.span("copy {count} sections", count=len(batch)):
+                    await self._copy(pool, batch, embeddings)
+            if retagged:
+                await self._retag(pool, retagged)
+            if prune:
+                await self._prune(pool, sections)
+
+    def _version(self, table: str, shadow: bool=False) -> PgVectorStore:
+        """This store pointed straight at one physical version table."""
+        store = copy.copy(self)
+        store.table = table
+        store.versioned = False
+        store.shadow = shadow
+        return store
+
+    async def _current_version(self) -> PgVectorStore | None:
+        async with self._connect(True) as pool:
+            # `rebuild` records the live version, then the previously live ones, in the comment of the view
+            history = await pool.fetchval(
+                "SELECT obj_description(oid, 'pg_class') FROM pg_class "
+                "WHERE relname = $1 AND relkind = 'v' AND pg_table_is_visible(oid)",
+                self.table
+            )
+        return self._version(history.split()[0]) if history else None
+
+    async def _refresh_view(self, current: PgVectorStore) -> None:
+        """Re-expand the view over `current`, the live version, after a load added columns to it.
+
+        `SELECT *` in a view is expanded once, when the view is created, so columns `_create_schema`
+        adds later (`embedding_full`, `content_tsv`) would otherwise stay invisible through it.
+        """
+        async with self._connect() as pool:
+            async with pool.acquire() as conn:
+                async with conn.transaction():
+                    # serialises with the switch in `rebuild`, which must not be undone here
+                    await conn.execute("SELECT pg_advisory_xact_lock(hashtext($1))", self.table)
+                    history: str = await conn.fetchval(
+                        "SELECT obj_description(oid, 'pg_class') FROM pg_class "
+                        "WHERE relname = $1 AND relkind = 'v' AND pg_table_is_visible(oid)",
+                        self.table
+                    ) or ""
+                    if history.split()[:1] != [current.table]: return
+                    columns = await conn.fetch(
+                        "SELECT count(*) AS columns FROM pg_attribute "
+                        "WHERE attrelid IN (to_regclass($1), to_regclass($2)) AND attnum > 0 AND NOT attisdropped "
+                        "GROUP BY attrelid",
+                        self.table, current.table
+                    )
+                    if len({row["columns"] for row in columns}) == 1: return
+                    with logfire.span("refresh {view} over {table}", view=self.table, table=current.table):
+                        # the table only ever gains columns, at the end, which `OR REPLACE` allows
+                        await conn.execute(f"CREATE OR REPLACE VIEW {self.table} AS SELECT * FROM {current.table}")
+
+    async def _versions(self, pool: asyncpg.Pool) -> list[int]:
+        names = await pool.fetch(
+            "SELECT relname FROM pg_class WHERE relkind = 'r' AND pg_table_is_visible(oid) "
+            "AND relname ~ ('^' || $1 || '_v[0-9]+$')",
+            self.table
+        )
+        return sorted(int(row["relname"].rsplit("_v", 1)[1]) for row in names)
+
+    async def _verify(self, pool: asyncpg.Pool, expected: int, sample_size: int, min_recall: float) -> None:
+        """Check the row count, and that sampled rows find themselves among their 10 nearest neighbours."""
+        count = await pool.fetchval(f"SELECT count(*) FROM {self.table}")
+        if count != expected:
+            raise RuntimeError(f"{self.table} has {count} rows, expected {expected}")
+
+        column = "embedding_full" if self.keep_full else "embedding"
+        sample = await pool.fetch(
+            f"SELECT id, {column} AS embedding FROM {self.table} ORDER BY random() LIMIT $1", sample_size
+        )
+        found = 0
+        for row in sample:
+            query, *full = self._query_args(row["embedding"])
+            hits = await pool.fetch(self._retrieve_sql, query, 10, *full)
+            found += any(hit["id"] == row["id"] for hit in hits)
+        recall = found / len(sample) if sample else 1.0
+        logfire.info("{table} sample recall {recall}", table=self.table, recall=recall)
+        if recall < min_recall:
+            raise RuntimeError(f"{self.table} sample recall {recall:.2f} is below {min_recall}")
+
+    async def rebuild(self, sections: Sequence[Section], sample_size: int=100, min_recall: float=0.9,
+                      keep_versions: int=1, **bulk_options) -> str:
+        """Blue/green rebuild: load `sections` into a new table version and switch `table` to it.
+
+        The new version is built with this store's embedder and index settings while readers keep
+        using the live one. Its row count and a sampled self-recall are verified before the view
+        named `table` is swapped over in one transaction; a build that fails is dropped. Then every
+        version table is dropped but the live one and the `keep_versions` that were live before it.
+        A plain table of the same name becomes version 0 on the first rebuild. `bulk_options` go
+        to `bulk_load`. Returns the name of the new version table.
+        """
+        if not self.versioned:
+            raise ValueError("rebuild needs a store created with versioned=True")
+
+        async with self._connect(True) as pool:
+            number = max(await self._versions(pool), default=0) + 1
+            shadow = self._version(f"{self.table}_v{number}", shadow=True)
+            try:
+                with logfire.span("build {table}", table=shadow.table):
+                    await shadow.bulk_load(sections, rebuild_index=True, **bulk_options)
+                    await shadow._verify(pool, len({section.uri for section in sections}), sample_size, min_recall)
+            except Exception:
+                await pool.execute(f"DROP TABLE IF EXISTS {shadow.table}")
+                raise
+
+            with logfire.span("switch {view} to {table}", view=self.table, table=shadow.table):
                 async with pool.acquire() as conn:
                     async with conn.transaction():
-                        await conn.execute(db_schema)
-
-            sem = Semaphore(10)
-            async with TaskGroup() as tg:
-                with logfire.span("insert sections"):
-                    for section in sections:
-                        tg.create_task(self._insert(
-                            sem, pool, section.uri, section.title, section.content,
-                            section.embedding_content
-                        ))
-
-    async def _insert(self, sem: Semaphore, pool: asyncpg.Pool,
-                     uri: str, title: str, content: str, embedding_content: str) -> None:
-        async with sem:
-            exists = await pool.fetchval(f"SELECT 1 FROM {self.table} WHERE uri = $1", uri)
-            if exists:
-                logfire.info("skipping {uri=}", uri=uri)
-                return
-
-            with logfire.span("create embedding for {uri=}", uri=uri):
-                embedding = await self.embedder.create_embedding(embedding_content)
-
-            embedding_json = pydantic_core.to_json(embedding).decode()
-            await pool.execute(
-                f"INSERT INTO {self.table} (uri, title, content, embedding) VALUES ($1, $2, $3, $4)",
-                uri, title, content, embedding_json
-            )
+                        await conn.execute("SELECT pg_advisory_xact_lock(hashtext($1))", self.table)
+                        kind = await conn.fetchval(
+                            "SELECT relkind::text FROM pg_class WHERE relname = $1 AND pg_table_is_visible(oid)",
+                            self.table
+                        )
+                        # tables that were live, most recent first
+                        history: list[str] = []
+                        if kind == "r":
+                            await conn.execute(f"ALTER TABLE {self.table} RENAME TO {self.table}_v0")
+                            history = [f"{self.table}_v0"]
+                        elif kind == "v":
+                            comment: str = await conn.fetchval(
+                                "SELECT obj_description(oid, 'pg_class') FROM pg_class "
+                                "WHERE relname = $1 AND relkind = 'v' AND pg_table_is_visible(oid)",
+                                self.table
+                            ) or ""
+                            history.extend(comment.split())
+                            await conn.execute(f"DROP VIEW {self.table}")
+                        history = [shadow.table] + history[:keep_versions]
+                        await conn.execute(f"CREATE VIEW {self.table} AS SELECT * FROM {shadow.table}")
+                        await conn.execute(f"COMMENT ON VIEW {self.table} IS '{' '.join(history)}'")
+
+            # versions beyond `keep_versions`, and builds that never went live
+            for version in await self._versions(pool):
+                if f"{self.table}_v{version}" in history: continue
+                with logfire.span("drop {table}_v{version}", table=self.table, version=version):
+                    await pool.execute(f"DROP TABLE IF EXISTS {self.table}_v{version}")
+        self.invalidate()
+        return shadow.table
+
+    async def _scan(self, batch_size: int) -> AsyncIterator[tuple[list[StoredSection], np.ndarray]]:
+        column = "embedding_full" if self.keep_full else "embedding"
+        async with self._connect() as pool:
+            async with pool.acquire() as conn:
+                async with conn.transaction():
+                    cursor = await conn.cursor(
+                        f"SELECT uri, title, content, content_hash, source, lang, tags, ingested_at, "
+                        f"{column} AS embedding FROM {self.table} ORDER BY id"
+                    )
+                    while rows := await cursor.fetch(batch_size):
+                        sections = [
+                            StoredSection(row["uri"], row["title"], row["content"], "", row["source"],
+                                          row["lang"], list(row["tags"]), row["ingested_at"],
+                                          stored_hash=row["content_hash"])
+                            for row in rows
+                        ]
+                        yield sections, np.asarray([row["embedding"] for row in rows], dtype=np.float32)
+
+    async def import_snapshot(self, path: str, rebuild_index: bool=False, maintenance_work_mem: str="1GB",
+                              parallel_workers: int=4) -> int:
+        """`RAGStore.import_snapshot` through `COPY`.
+
+        With `rebuild_index` the HNSW index is dropped for the import and built once afterwards,
+        as in `bulk_load`: much faster for large snapshots, but searches meanwhile scan sequentially.
+        """
+        snapshot = self._open_snapshot(path)
+        with logfire.span("import {count} sections from {path}", count=snapshot.count, path=path):
+            await self._import(snapshot, rebuild_index, maintenance_work_mem, parallel_workers)
+        self.invalidate()
+        return snapshot.count
+
+    async def _import(self, snapshot: Snapshot, rebuild_index: bool=False, maintenance_work_mem: str="1GB",
+                      parallel_workers: int=4) -> None:
+        if self.versioned:
+            current = await self._current_version()
+            if current is None:
+                raise ValueError(f"{self.table} has no version yet, build one with load or rebuild")
+            await current._import(snapshot, rebuild_index, maintenance_work_mem, parallel_workers)
+            return await self._refresh_view(current)
+        if self.keep_full and snapshot.dimensions != self.embedder.dimensions:
+            raise ValueError("keep_full needs a snapshot of full embeddings")
+        async with self._bulk(rebuild_index, maintenance_work_mem, parallel_workers) as pool:
+            for sections, embeddings in snapshot.chunks():
+                with logfire.span("copy {count} sections", count=len(sections)):
+                    await self._copy(pool, sections, embeddings)
 
-    async def retrieve(self, query: str, limit: int) -> str:
-        with logfire.span("create embedding for {query=}", query=query):
-            embedding = await self.embedder.create_embedding(query)
-            embedding_json = pydantic_core.to_json(embedding).decode()
+    async def _copy(self, pool: asyncpg.Pool, sections: Sequence[Section],
+                    embeddings: list[list[float]] | np.ndarray) -> None:
+        # `COPY` cannot upsert, so stage through a temp table and merge from there
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute(
+                    "CREATE TEMP TABLE _staging "
+                    "(uri text, title text, content text, content_hash text, meta_hash text, source text, lang text, "
+                    "tags text[], ingested_at timestamptz, embedding vector, embedding_full vector) "
+                    "ON COMMIT DROP"
+                )
+                columns = self._columns
+                await conn.copy_records_to_table(
+                    "_staging", records=self._records(sections, embeddings), columns=columns
+                )
+                await conn.execute(
+                    f"INSERT INTO {self.table} ({', '.join(columns)}) "
+                    f"SELECT {', '.join(columns)} FROM _staging {self._upsert_clause}"
+                )
 
+    def cosine_distance(self, distance: float) -> float:
+        # `<->` is the L2 distance; for the unit-length vectors embedding models return,
+        # |a - b|^2 = 2 - 2 cos(a, b)
+        return distance * distance / 2
+
+    @staticmethod
+    def _hit(row: asyncpg.Record) -> Hit:
+        return Hit(row["uri"], row["title"], row["content"], row["distance"], row["id"],
+                   row.get("hit_embedding"))
+
+    async def _fetch(self, sql: str, args: list, filtered: bool) -> list[asyncpg.Record]:
         async with self._connect() as pool:
-            rows = await pool.fetch(
-                f"SELECT uri, title, content FROM {self.table} ORDER BY embedding <-> $1 LIMIT $2",
-                embedding_json, limit
+            if not filtered or not self.iterative_scan:
+                return await pool.fetch(sql, *args)
+            # let HNSW keep scanning until enough rows pass the filter; before pgvector 0.8 the
+            # `hnsw.` settings prefix is reserved and an unknown name is an error
+            async with pool.acquire() as conn:
+                async with conn.transaction():
+                    await conn.execute("SET LOCAL hnsw.iterative_scan = strict_order")
+                    return await conn.fetch(sql, *args)
+
+    async def search(self, query: str, limit: int, filter: SectionFilter | None=None,
+                     with_embeddings: bool=False, lexical_weight: float | None=None,
+                     rrf_k: int=60) -> list[Hit]:
+        """Nearest-neighbour search, fused with full-text search when `lexical_weight` > 0.
+
+        `lexical_weight` (0 to 1, defaults to the store setting) balances the full-text ranking
+        against the vector ranking in reciprocal rank fusion with constant `rrf_k`; it needs a
+        store created with `full_text` or a `lexical_weight`.
+        """
+        if lexical_weight is None:
+            lexical_weight = self._lexical_weight
+        if lexical_weight > 0 and not self.full_text:
+            raise ValueError("hybrid search needs a store created with full_text=True or a lexical_weight")
+        embedding, *full = self._query_args(await self.embed_query(query))
+
+        if lexical_weight > 0:
+            filters, filter_args = self._filter_sql(filter, 6 + len(full))
+            sql = HYBRID_QUERY.format(
+                table=self.table, ts_config=self.ts_config, rrf_k=int(rrf_k),
+                nearest=self._nearest_sql("$1::vector", "$3", "$6::vector", filters),
+                distance=self._distance_sql("$1::vector", "$6::vector", prefix="t."),
+                embedding=self._embedding_sql(prefix="t.") if with_embeddings else "",
+                filter="".join(f" AND {clause}" for clause in filters)
             )
-            return "\n\n".join(
-                f"# {row['title']}\nURI:{row['uri']}\n\n{row['content']}\n"
-                for row in rows
+            args = [embedding, query, max(limit * 4, 40), float(lexical_weight), limit, *full]
+        else:
+            filters, filter_args = self._filter_sql(filter, 3 + len(full))
+            sql = self._nearest_sql("$1::vector", "$2", "$3::vector", filters, with_embeddings)
+            args = [embedding, limit, *full]
+        rows = await self._fetch(sql, args + filter_args, bool(filters))
+        return [self._hit(row) for row in rows]
+
+    async def search_many(self, queries: list[str], limit: int, filter: SectionFilter | None=None,
+                          with_embeddings: bool=False) -> list[list[Hit]]:
+        if self._lexical_weight > 0:
+            return await super().search_many(queries, limit, filter, with_embeddings)
+
+        embeddings = await self.embed_queries(queries)
+        args = [[encode_vector(e) for e in self.truncate(embeddings)], limit]
+        if self.keep_full:
+            args.append([encode_vector(e) for e in embeddings])
+            unnest, columns = "unnest($1::vector[], $3::vector[])", "query_embedding, full_query_embedding"
+        else:
+            unnest, columns = "unnest($1::vector[])", "query_embedding"
+        filters, filter_args = self._filter_sql(filter, len(args) + 1)
+        sql = MULTI_QUERY.format(
+            unnest=unnest, columns=columns,
+            nearest=self._nearest_sql(
+                "q.query_embedding", "$2", "q.full_query_embedding", filters, with_embeddings
             )
+        )
+        rows = await self._fetch(sql, args + filter_args, bool(filters))
+
+        grouped: list[list[Hit]] = [[] for _ in queries]
+        for row in rows:
+            grouped[row["ord"] - 1].append(self._hit(row))
+        return grouped
+
+    @property
+    def _lexical_weight(self) -> float:
+        weight = _retrieve_weight.get()
+        return self.lexical_weight if weight is None else weight
+
+    def _result_key(self, limit: int, filter: SectionFilter | None) -> Hashable:
+        return (super()._result_key(limit, filter), self._lexical_weight)
+
+    async def retrieve_hits(self, query: str, limit: int, filter: SectionFilter | None=None,
+                            lexical_weight: float | None=None) -> list[Hit]:
+        """`RAGStore.retrieve_hits`, with `lexical_weight` overriding the store setting (see `search`)."""
+        if lexical_weight is None:
+            return await super().retrieve_hits(query, limit, filter)
+        token = _retrieve_weight.set(lexical_weight)
+        try:
+            return await super().retrieve_hits(query, limit, filter)
+        finally:
+            _retrieve_weight.reset(token)
+
+    async def retrieve(self, query: str, limit: int, filter: SectionFilter | None=None,
+                       lexical_weight: float | None=None) -> str:
+        return format_hits(await self.retrieve_hits(query, limit, filter, lexical_weight))
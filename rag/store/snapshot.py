@@ -0,0 +1,87 @@
+from __future__ import annotations as _annotations
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator, Sequence
+
+import json
+
+import numpy as np
+
+from rag.store.base import Section, StoredSection
+
+
+# A snapshot is a directory of chunks, each a raw float32 `.npy` block of embeddings plus a `.json`
+# file holding the section columns, and a `manifest.json` written last so a partial export is
+# never mistaken for a complete one.
+FORMAT = "neb-snapshot/1"
+COLUMNS = ("uri", "title", "content", "content_hash", "source", "lang", "tags", "ingested_at")
+
+
+class SnapshotWriter:
+    def __init__(self, path: str | Path, model: str, dimensions: int) -> None:
+        self.root = Path(path)
+        self.root.mkdir(parents=True, exist_ok=True)
+        (self.root / "manifest.json").unlink(missing_ok=True)
+        self.model = model
+        self.dimensions = dimensions
+        self.chunks: list[dict] = []
+        self.count = 0
+
+    def write(self, sections: Sequence[Section], embeddings) -> None:
+        block = np.ascontiguousarray(embeddings, dtype=np.float32)
+        if block.shape != (len(sections), self.dimensions):
+            raise ValueError(f"expected {len(sections)} x {self.dimensions} embeddings, got {block.shape}")
+        name = f"{len(self.chunks):05d}"
+        np.save(self.root / f"{name}.npy", block)
+        columns = {
+            "uri": [section.uri for section in sections],
+            "title": [section.title for section in sections],
+            "content": [section.content for section in sections],
+            "content_hash": [section.content_hash for section in sections],
+            "source": [section.source for section in sections],
+            "lang": [section.lang for section in sections],
+            "tags": [section.tags for section in sections],
+            "ingested_at": [section.ingested_at.isoformat() for section in sections],
+        }
+        with open(self.root / f"{name}.json", "w", encoding="utf-8") as f:
+            json.dump(columns, f, ensure_ascii=False)
+        self.chunks.append({"name": name, "rows": len(sections)})
+        self.count += len(sections)
+
+    def close(self) -> None:
+        manifest = {
+            "format": FORMAT, "model": self.model, "dimensions": self.dimensions,
+            "count": self.count, "chunks": self.chunks,
+        }
+        with open(self.root / "manifest.json", "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+
+
+class Snapshot:
+    """Read side of a snapshot directory; `chunks` can be iterated any number of times."""
+
+    def __init__(self, path: str | Path) -> None:
+        self.root = Path(path)
+        with open(self.root / "manifest.json", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("format") != FORMAT:
+            raise ValueError(f"{self.root} is not a {FORMAT} snapshot")
+        self.model: str = manifest["model"]
+        self.dimensions: int = manifest["dimensions"]
+        self.count: int = manifest["count"]
+        self.names: list[str] = [chunk["name"] for chunk in manifest["chunks"]]
+
+    def columns(self, name: str) -> dict[str, list]:
+        with open(self.root / f"{name}.json", encoding="utf-8") as f:
+            return json.load(f)
+
+    def chunks(self) -> Iterator[tuple[list[StoredSection], np.ndarray]]:
+        for name in self.names:
+            columns = self.columns(name)
+            sections = [
+                StoredSection(uri, title, content, "", source, lang, tags,
+                              datetime.fromisoformat(ingested_at), stored_hash=content_hash)
+                for uri, title, content, content_hash, source, lang, tags, ingested_at
+                in zip(*(columns[column] for column in COLUMNS))
+            ]
+            yield sections, np.load(self.root / f"{name}.npy", mmap_mode="r")
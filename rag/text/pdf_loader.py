@@ -5,7 +5,7 @@ from marker.models import create_model_dict
 from marker.config.parser import ConfigParser
 from marker.output import text_from_rendered
 
-from rag.text.chunk import chunk_text
+from rag.text.chunk import chunk_text, iter_chunks, pack_sentences
 
 
 default_config = {
@@ -34,9 +34,22 @@ class PDFLoader:
             text, _, _ = text_from_rendered(rendered)
             return text
 
-    def chunks(self, batch_size=1) -> list[str]:
+    def chunks(self, batch_size=1, engine="spacy") -> list[str]:
         text = self.extract_text()
-        return chunk_text(text, batch_size)
+        return chunk_text(text, batch_size, engine)
+
+    def iter_chunks(self, batch_size=1, n_process=None, engine="spacy"):
+        """Like `chunks`, but segmented on all cores and yielded as they are ready."""
+        text = self.extract_text()
+        return iter_chunks(text, batch_size, n_process, engine=engine)
+
+    def token_chunks(self, target_tokens=256, overlap_tokens=32, max_tokens=512, engine="spacy",
+                     **pack_options) -> list[tuple[str, int]]:
+        """Chunks packed to a token budget as `(text, tokens)` pairs, see `pack_sentences`."""
+        text = self.extract_text()
+        return list(pack_sentences(
+            iter_chunks(text, 1, engine=engine), target_tokens, overlap_tokens, max_tokens, **pack_options
+        ))
 
 
 if __name__ == "__main__":
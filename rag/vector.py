@@ -0,0 +1,9 @@
+from __future__ import annotations as _annotations
+
+import numpy as np
+
+
+def normalize(matrix: np.ndarray) -> np.ndarray:
+    """L2-normalize the last axis of `matrix`; zero vectors are left as they are."""
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)